@@ -0,0 +1,154 @@
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from app.qif_indexer import QIFIndexer
+from app.singleflight import SingleFlight
+from app.sql_templates import SQLTemplateCache
+
+DEFAULT_DATASET = "default"
+
+_DATASET_ID_RE = re.compile(r"[A-Za-z0-9][A-Za-z0-9_-]{0,63}")
+
+
+class Dataset:
+    """One tenant: its QIF directory, SQLite database and the caches built on top of them."""
+
+    def __init__(self, dataset_id: str, qif_dir: str, db_path: str, template_cache_size: int):
+        self.id = dataset_id
+        self.indexer = QIFIndexer(qif_dir, db_path)
+        self.template_cache_size = template_cache_size
+        self.template_cache = None
+        # Identical questions (and identical final SQL) arriving at the same time
+        # share one SQL plan / one query execution instead of each starting their own.
+        self.question_flight = SingleFlight(f"{dataset_id}:question")
+        self.sql_flight = SingleFlight(f"{dataset_id}:sql")
+
+    @property
+    def engine(self):
+        return self.indexer.engine
+
+    def open(self):
+        self.indexer.ensure_database()
+        # Created afterwards: ensure_database swaps in a read-only engine on follower workers.
+        self.template_cache = SQLTemplateCache(self.indexer.engine, max_size=self.template_cache_size)
+
+    def close(self):
+        self.indexer.close()
+
+
+class DatasetRegistry:
+    """
+    Map dataset identifiers to Datasets, keeping at most ``max_open`` of them open.
+
+    The default dataset uses QIF_DIR/DB_PATH. Any other identifier ``<id>`` is served
+    from ``<qif_root>/<id>`` into ``<db_root>/<id>.db`` when ``qif_root`` is set and
+    that directory exists. Datasets are ingested on first use and the least recently
+    used one is closed when the limit is reached, which bounds open files and memory.
+    The default dataset is pinned: it stays open and does not count towards the limit.
+    """
+
+    def __init__(self, qif_dir: str, db_path: str, qif_root: str = None, db_root: str = None,
+                 max_open: int = 32, template_cache_size: int = 256):
+        self.qif_dir = qif_dir
+        self.db_path = db_path
+        self.qif_root = qif_root
+        self.db_root = db_root or os.path.dirname(db_path)
+        self.max_open = max(max_open, 1)
+        self.template_cache_size = template_cache_size
+        self.logger = logging.getLogger("datasets")
+        self._lock = threading.Lock()
+        self._open = OrderedDict()
+        self._pinned = {}
+        self._opening = {}
+
+    @classmethod
+    def from_env(cls, qif_dir: str, db_path: str):
+        return cls(
+            qif_dir,
+            db_path,
+            qif_root=os.getenv("DATASETS_QIF_ROOT") or None,
+            db_root=os.getenv("DATASETS_DB_ROOT") or None,
+            max_open=int(os.getenv("DATASET_CACHE_SIZE", "32")),
+            template_cache_size=int(os.getenv("SQL_TEMPLATE_CACHE_SIZE", "256")),
+        )
+
+    def get(self, dataset_id: str = DEFAULT_DATASET) -> Dataset:
+        """
+        Return the open Dataset for ``dataset_id``, ingesting it if needed.
+        Raises ValueError for a malformed identifier and LookupError for an unknown one.
+        """
+        with self._lock:
+            dataset = self._cached(dataset_id)
+            if dataset is not None:
+                return dataset
+            qif_dir, db_path = self._paths(dataset_id)
+            # Concurrent first requests for the same dataset wait for one ingest.
+            opening = self._opening.setdefault(dataset_id, _Opening())
+            opening.waiters += 1
+
+        evicted = []
+        try:
+            with opening.lock:
+                with self._lock:
+                    dataset = self._cached(dataset_id)
+                    if dataset is not None:
+                        return dataset
+
+                dataset = Dataset(dataset_id, qif_dir, db_path, self.template_cache_size)
+                try:
+                    dataset.open()
+                except BaseException:
+                    dataset.close()
+                    raise
+                self.logger.info("Opened dataset %s (%s)", dataset_id, db_path)
+
+                with self._lock:
+                    if dataset_id == DEFAULT_DATASET:
+                        self._pinned[dataset_id] = dataset
+                    else:
+                        self._open[dataset_id] = dataset
+                        while len(self._open) > self.max_open:
+                            evicted.append(self._open.popitem(last=False)[1])
+        finally:
+            with self._lock:
+                opening.waiters -= 1
+                # Keep the lock while anyone still queues on it (e.g. to retry a
+                # failed ingest), so a newcomer cannot start a second one alongside.
+                if opening.waiters == 0 and self._opening.get(dataset_id) is opening:
+                    del self._opening[dataset_id]
+        for old in evicted:
+            self.logger.info("Closing least recently used dataset %s", old.id)
+            old.close()
+        return dataset
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"pinned": list(self._pinned), "open": list(self._open), "max_open": self.max_open}
+
+    def _cached(self, dataset_id: str):
+        """Return an already open dataset and mark it recently used (caller holds the lock)."""
+        dataset = self._pinned.get(dataset_id) or self._open.get(dataset_id)
+        if dataset_id in self._open:
+            self._open.move_to_end(dataset_id)
+        return dataset
+
+    def _paths(self, dataset_id: str):
+        if dataset_id == DEFAULT_DATASET:
+            return self.qif_dir, self.db_path
+        if not _DATASET_ID_RE.fullmatch(dataset_id):
+            raise ValueError(f"Invalid dataset identifier: {dataset_id!r}")
+        qif_dir = os.path.join(self.qif_root, dataset_id) if self.qif_root else None
+        if qif_dir is None or not os.path.isdir(qif_dir):
+            raise LookupError(f"Unknown dataset: {dataset_id}")
+        return qif_dir, os.path.join(self.db_root, f"{dataset_id}.db")
+
+
+class _Opening:
+    __slots__ = ("lock", "waiters")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.waiters = 0
@@ -0,0 +1,212 @@
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+
+
+class PoolSaturated(Exception):
+    """Every endpoint is busy and the wait queue is full (or the wait timed out)."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class PoolUnavailable(Exception):
+    """Every usable endpoint has its circuit breaker open."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Endpoint:
+    def __init__(self, url: str, max_concurrency: int):
+        self.url = url.rstrip("/")
+        self.max_concurrency = max_concurrency
+        self.outstanding = 0
+        self.failures = 0
+        self.open_until = 0.0
+        self.requests = 0
+        self.errors = 0
+
+    def state(self, now: float) -> str:
+        if self.open_until > now:
+            return "open"
+        if self.open_until:
+            return "half_open"
+        return "closed"
+
+    def available(self, now: float) -> bool:
+        state = self.state(now)
+        if state == "open":
+            return False
+        if state == "half_open":
+            # Let a single probe request through before trusting the endpoint again.
+            return self.outstanding == 0
+        return self.outstanding < self.max_concurrency
+
+
+class LLMPool:
+    """
+    Route LLM requests over several Ollama endpoints.
+
+    Each endpoint has its own concurrency limit; requests go to the endpoint
+    with the fewest outstanding requests. When all of them are busy, callers wait
+    in a bounded queue, and are turned away with PoolSaturated once it is full.
+    Endpoints that fail ``failure_threshold`` times in a row are skipped for
+    ``cooldown`` seconds, then re-admitted after one successful probe.
+    """
+
+    def __init__(self, endpoints, max_queue: int = 16, queue_timeout: float = 30.0,
+                 failure_threshold: int = 3, cooldown: float = 30.0):
+        self.endpoints = endpoints
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.logger = logging.getLogger("llm_pool")
+        self._cond = threading.Condition()
+        self._waiting = 0
+        self._avg_latency = 5.0
+
+    @classmethod
+    def from_env(cls, default_url: str):
+        """
+        Build the pool from OLLAMA_URLS, a comma-separated list of endpoints that
+        falls back to ``default_url``. An entry may end in ``=N`` to override
+        OLLAMA_MAX_CONCURRENCY for that endpoint, e.g. ``http://gpu1:11434=4``.
+        """
+        default_concurrency = int(os.getenv("OLLAMA_MAX_CONCURRENCY", "2"))
+        endpoints = []
+        for entry in os.getenv("OLLAMA_URLS", default_url).split(","):
+            entry = entry.strip()
+            if not entry:
+                continue
+            url, _, limit = entry.rpartition("=")
+            if url and limit.isdigit():
+                endpoints.append(Endpoint(url, int(limit)))
+            else:
+                endpoints.append(Endpoint(entry, default_concurrency))
+        return cls(
+            endpoints,
+            max_queue=int(os.getenv("LLM_QUEUE_SIZE", "16")),
+            queue_timeout=float(os.getenv("LLM_QUEUE_TIMEOUT", "30")),
+            failure_threshold=int(os.getenv("LLM_BREAKER_FAILURES", "3")),
+            cooldown=float(os.getenv("LLM_BREAKER_COOLDOWN", "30")),
+        )
+
+    @property
+    def capacity(self) -> int:
+        return sum(ep.max_concurrency for ep in self.endpoints)
+
+    @contextmanager
+    def lease(self, exclude=()):
+        """
+        Hold a slot on the least loaded endpoint for the duration of the block.
+        A ``requests.RequestException`` raised inside counts as an endpoint failure.
+        """
+        endpoint = self.acquire(exclude)
+        started = time.monotonic()
+        try:
+            yield endpoint
+        except requests.RequestException:
+            self.release(endpoint, ok=False)
+            raise
+        except BaseException:
+            self.release(endpoint, ok=True)
+            raise
+        else:
+            self.release(endpoint, ok=True, elapsed=time.monotonic() - started)
+
+    def acquire(self, exclude=()) -> Endpoint:
+        with self._cond:
+            endpoint = self._pick(exclude)
+            if endpoint is not None:
+                return endpoint
+            if self._waiting >= self.max_queue:
+                raise PoolSaturated("LLM queue is full", self._retry_after())
+
+            self._waiting += 1
+            deadline = time.monotonic() + self.queue_timeout
+            try:
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolSaturated("Timed out waiting for an LLM endpoint", self._retry_after())
+                    self._cond.wait(remaining)
+                    endpoint = self._pick(exclude)
+                    if endpoint is not None:
+                        return endpoint
+            finally:
+                self._waiting -= 1
+
+    def release(self, endpoint: Endpoint, ok: bool, elapsed: float = None):
+        with self._cond:
+            endpoint.outstanding -= 1
+            if ok:
+                if endpoint.open_until:
+                    self.logger.info("LLM endpoint %s recovered", endpoint.url)
+                endpoint.failures = 0
+                endpoint.open_until = 0.0
+                if elapsed is not None:
+                    self._avg_latency = 0.8 * self._avg_latency + 0.2 * elapsed
+            else:
+                endpoint.errors += 1
+                endpoint.failures += 1
+                if endpoint.failures >= self.failure_threshold or endpoint.open_until:
+                    endpoint.open_until = time.monotonic() + self.cooldown
+                    self.logger.warning(
+                        "LLM endpoint %s failed %s time(s); circuit open for %.0fs",
+                        endpoint.url,
+                        endpoint.failures,
+                        self.cooldown,
+                    )
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._cond:
+            return {
+                "capacity": self.capacity,
+                "in_flight": sum(ep.outstanding for ep in self.endpoints),
+                "queue_depth": self._waiting,
+                "queue_capacity": self.max_queue,
+                "endpoints": [
+                    {
+                        "url": ep.url,
+                        "state": ep.state(now),
+                        "outstanding": ep.outstanding,
+                        "max_concurrency": ep.max_concurrency,
+                        "requests": ep.requests,
+                        "errors": ep.errors,
+                    }
+                    for ep in self.endpoints
+                ],
+            }
+
+    def _pick(self, exclude):
+        """Claim the usable endpoint with the fewest outstanding requests (caller holds the lock)."""
+        now = time.monotonic()
+        candidates = [ep for ep in self.endpoints if ep.url not in exclude]
+        if not candidates:
+            raise PoolUnavailable("No LLM endpoint left to try", 1)
+        if all(ep.state(now) == "open" for ep in candidates):
+            retry_after = math.ceil(min(ep.open_until for ep in candidates) - now)
+            raise PoolUnavailable("All LLM endpoints are failing", max(retry_after, 1))
+
+        available = [ep for ep in candidates if ep.available(now)]
+        if not available:
+            return None
+        endpoint = min(available, key=lambda ep: (ep.outstanding, ep.outstanding / ep.max_concurrency))
+        endpoint.outstanding += 1
+        endpoint.requests += 1
+        return endpoint
+
+    def _retry_after(self) -> int:
+        """Rough time until a queued request would be served, from the recent generation latency."""
+        return max(1, math.ceil(self._avg_latency * (self._waiting + 1) / max(self.capacity, 1)))
@@ -1,14 +1,21 @@
+import asyncio
 import json
 import logging
 import os
 import re
+import time
+from typing import List
 
 import requests
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
 from sqlalchemy import text
 
-from app.qif_indexer import QIFIndexer
+from app.datasets import DEFAULT_DATASET, Dataset, DatasetRegistry
+from app.llm_pool import LLMPool, PoolSaturated, PoolUnavailable
+from app.sql_rewriter import cap_rows, parse_select, rewrite_sql
 
 # Configure logging
 default_level = os.getenv("LOG_LEVEL", "INFO")
@@ -21,13 +28,42 @@ db_path = os.getenv("DB_PATH", "/db/transactions.db")
 ollama_url = os.getenv("OLLAMA_URL", "http://localhost:11434")
 ollama_model = os.getenv("OLLAMA_MODEL", "phi4-mini:3.8b")
 
+# Generation options sent with every Ollama request. A single SELECT rarely needs
+# more than a couple of hundred tokens, so cap the output and stop at the end of
+# the statement instead of letting small models ramble on.
+ollama_num_predict = int(os.getenv("OLLAMA_NUM_PREDICT", "256"))
+ollama_num_ctx = int(os.getenv("OLLAMA_NUM_CTX", "2048"))
+ollama_temperature = float(os.getenv("OLLAMA_TEMPERATURE", "0"))
+# Only ";" is sent as a server-side stop: Ollama also stops on a match at the
+# very start of the output, so a blank line before the SQL would end generation
+# with nothing. Blank-line termination is handled client-side by _complete_statement.
+ollama_stop = [";"]
+
+# Rows per "rows" event on /chat/stream.
+STREAM_CHUNK_ROWS = 200
+
+llm_pool = LLMPool.from_env(ollama_url)
+
 # Create FastAPI app
 app = FastAPI()
 
-# Ensure database
-indexer = QIFIndexer(qif_dir, db_path)
-indexer.ensure_database()
-logger.info("Database ready at %s", db_path)
+# Ensure database. Requests pick a dataset with the X-Dataset header or the
+# ?dataset= query parameter; without one they use QIF_DIR/DB_PATH.
+datasets = DatasetRegistry.from_env(qif_dir, db_path)
+default_indexer = datasets.get(DEFAULT_DATASET).indexer
+logger.info(
+    "Database ready at %s (%s, generation %s)", db_path, default_indexer.role, default_indexer.generation
+)
+
+
+async def current_dataset(request: Request) -> Dataset:
+    dataset_id = request.headers.get("X-Dataset") or request.query_params.get("dataset") or DEFAULT_DATASET
+    try:
+        return await run_in_threadpool(datasets.get, dataset_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
 
 
 def format_markdown_table(rows):
@@ -40,6 +76,10 @@ def format_markdown_table(rows):
     return "\n".join([header_line, sep_line, body])
 
 
+def truncation_note(rows) -> str:
+    return f"Showing the first {len(rows)} row(s); more rows matched (SQL_ROW_LIMIT)."
+
+
 def format_human_readable(rows):
     if not rows:
         return "No results found."
@@ -50,26 +90,46 @@ def format_human_readable(rows):
 
 
 def sanitize_llm_sql(raw_sql: str) -> str:
-    """Allow only a single SELECT statement and block dangerous SQL operations."""
+    """Parse the LLM output and allow only a single read-only SELECT statement."""
     if not raw_sql:
         raise HTTPException(status_code=500, detail="No SQL was generated by the LLM.")
 
-    if ";" in raw_sql.strip().rstrip(";"):
-        raise HTTPException(status_code=500, detail="Multiple SQL statements are not allowed.")
-
     sql = re.sub(r"```sql\s*", "", raw_sql, flags=re.IGNORECASE)
     sql = re.sub(r"```", "", sql).strip().rstrip(";")
     if not sql:
         raise HTTPException(status_code=500, detail="No SQL was generated by the LLM.")
 
-    lowered = sql.lower()
-    disallowed = ["insert", "update", "delete", "drop", "alter", "pragma", "attach", "vacuum"]
-    if not lowered.startswith("select"):
-        raise HTTPException(status_code=500, detail=f"Only SELECT is allowed. SQL: {sql}")
-    if any(re.search(rf"\b{keyword}\b", lowered) for keyword in disallowed):
-        raise HTTPException(status_code=500, detail="Generated SQL contains blocked keywords.")
+    try:
+        return parse_select(sql).sql(dialect="sqlite")
+    except ValueError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# Words that can start a line continuing a SELECT; after a blank line anything
+# else (e.g. "This query ...") is taken as prose following the statement.
+SQL_CONTINUATIONS = {
+    "and", "as", "asc", "between", "case", "collate", "cross", "desc", "distinct", "else", "end", "escape",
+    "except", "from", "group", "having", "in", "inner", "intersect", "is", "join", "left", "like", "limit",
+    "not", "offset", "on", "or", "order", "outer", "right", "select", "then", "union", "using", "when",
+    "where", "window", "with",
+}
+
+_TERMINATOR_RE = re.compile(r";|```|\n[ \t]*\n(?=\s*(?:(?P<word>[A-Za-z_]\w*)(?=\W)|[^\s`A-Za-z_]))")
+
 
-    return sql
+def _complete_statement(raw_sql: str):
+    """Return the SQL statement in ``raw_sql`` if it is already terminated, else None.
+
+    A statement counts as complete once the model has written a terminator after
+    it: a semicolon, a closing code fence, or a blank line followed by a word that
+    cannot continue the SQL. A blank line before ``WHERE`` or ``GROUP BY`` is not an end.
+    """
+    body = re.sub(r"^\s*```(?:sql)?\s*", "", raw_sql, flags=re.IGNORECASE).lstrip()
+    for match in _TERMINATOR_RE.finditer(body):
+        word = match.group("word")
+        if match.group(0) in (";", "```") or (word and word.lower() not in SQL_CONTINUATIONS):
+            return body[: match.start()]
+    return None
 
 
 def generate_sql(question: str) -> str:
@@ -82,47 +142,138 @@ def generate_sql(question: str) -> str:
         f"Question: {question}\nSQL:"
     )
 
-    try:
-        with requests.post(
-            f"{ollama_url}/api/generate",
-            json={"model": ollama_model, "prompt": prompt},
-            stream=True,
-            timeout=(5, 60),
-        ) as response:
-            if response.status_code != 200:
-                raise HTTPException(status_code=500, detail=f"Ollama error: {response.text}")
-
-            raw_sql = ""
-            for line in response.iter_lines():
-                if not line:
-                    continue
-                line_decoded = line.decode("utf-8")
-                logger.debug("Raw line from LLM: %s", line_decoded)
-                try:
-                    obj = json.loads(line_decoded)
-                    raw_sql += obj.get("response", "")
-                except Exception as e:
-                    logger.warning("Failed to parse JSON: %s | Line: %s", e, line_decoded)
-
-        logger.info("Raw SQL from LLM before cleanup: %s", raw_sql)
-        return sanitize_llm_sql(raw_sql)
-    except requests.RequestException as exc:
-        logger.exception("Failed to query Ollama")
-        raise HTTPException(status_code=503, detail=f"Failed to query Ollama: {exc}")
+    tried = set()
+    while True:
+        try:
+            with llm_pool.lease(exclude=tried) as endpoint:
+                tried.add(endpoint.url)
+                raw_sql = _stream_sql(endpoint.url, prompt)
+            logger.info("Raw SQL from LLM before cleanup: %s", raw_sql)
+            return sanitize_llm_sql(raw_sql)
+        except PoolSaturated as exc:
+            logger.warning("Rejecting question: %s", exc)
+            raise HTTPException(status_code=429, detail=str(exc), headers={"Retry-After": str(exc.retry_after)})
+        except PoolUnavailable as exc:
+            logger.error("No LLM endpoint available: %s", exc)
+            raise HTTPException(status_code=503, detail=str(exc), headers={"Retry-After": str(exc.retry_after)})
+        except requests.RequestException as exc:
+            logger.exception("Failed to query Ollama at %s", endpoint.url)
+            if len(tried) >= len(llm_pool.endpoints):
+                raise HTTPException(status_code=503, detail=f"Failed to query Ollama: {exc}")
+            # Fail over to an endpoint that has not been tried for this question.
+
+
+def _stream_sql(url: str, prompt: str) -> str:
+    """Stream a completion from one Ollama endpoint, stopping at the first complete statement."""
+    options = {
+        "num_predict": ollama_num_predict,
+        "num_ctx": ollama_num_ctx,
+        "temperature": ollama_temperature,
+        "stop": ollama_stop,
+    }
+
+    started = time.monotonic()
+    first_token_at = last_token_at = None
+    eval_duration = None
+    tokens = 0
+    stopped_early = False
+    with requests.post(
+        f"{url}/api/generate",
+        json={"model": ollama_model, "prompt": prompt, "options": options},
+        stream=True,
+        timeout=(5, 60),
+    ) as response:
+        if response.status_code >= 500:
+            raise requests.HTTPError(f"Ollama error: {response.text}", response=response)
+        if response.status_code != 200:
+            raise HTTPException(status_code=500, detail=f"Ollama error: {response.text}")
+
+        raw_sql = ""
+        tried = None
+        for line in response.iter_lines():
+            if not line:
+                continue
+            line_decoded = line.decode("utf-8")
+            logger.debug("Raw line from LLM: %s", line_decoded)
+            try:
+                obj = json.loads(line_decoded)
+            except Exception as e:
+                logger.warning("Failed to parse JSON: %s | Line: %s", e, line_decoded)
+                continue
+
+            if obj.get("done"):
+                tokens = obj.get("eval_count", tokens)
+                if obj.get("eval_duration"):
+                    eval_duration = obj["eval_duration"] / 1e9
+                break
+
+            raw_sql += obj.get("response", "")
+            tokens += 1
+            last_token_at = time.monotonic()
+            if first_token_at is None:
+                first_token_at = last_token_at
+
+            statement = _complete_statement(raw_sql)
+            if statement is None or statement == tried:
+                continue
+            # Parse each candidate once; a prefix that failed stays failed until it grows.
+            tried = statement
+            try:
+                sanitize_llm_sql(statement)
+            except HTTPException:
+                continue
+            # The statement is usable as-is; closing the response stops Ollama
+            # from generating (and us from waiting on) the rest of the output.
+            raw_sql = statement
+            stopped_early = True
+            break
+
+    if eval_duration is not None and tokens:
+        per_token = eval_duration / tokens
+    elif first_token_at is not None and tokens > 1:
+        # Stopped before Ollama reported eval_duration: use the gap between streamed
+        # tokens, which leaves out connect time and prompt evaluation.
+        per_token = (last_token_at - first_token_at) / (tokens - 1)
+    else:
+        per_token = 0.0
+    _log_generation_stats(tokens, time.monotonic() - started, per_token, stopped_early)
+    return raw_sql
+
+
+def _log_generation_stats(tokens: int, elapsed: float, per_token: float, stopped_early: bool):
+    """Log token usage for one generation and an estimate of what early stopping saved.
+
+    The saving is estimated from the unused ``num_predict`` budget at the
+    per-token generation latency of this request.
+    """
+    tokens_saved = max(ollama_num_predict - tokens, 0) if stopped_early else 0
+    logger.info(
+        "LLM generation: tokens=%s elapsed=%.3fs stopped_early=%s tokens_saved~%s time_saved~%.3fs",
+        tokens,
+        elapsed,
+        stopped_early,
+        tokens_saved,
+        tokens_saved * per_token,
+    )
 
 
 class Query(BaseModel):
     question: str
 
 
+class BatchQuery(BaseModel):
+    questions: List[str] = Field(..., min_length=1, max_length=100)
+    stream: bool = False
+
+
 @app.get("/transactions/{year}")
-async def list_transactions(year: int):
+async def list_transactions(year: int, dataset: Dataset = Depends(current_dataset)):
     try:
         q = text(
             "SELECT date, payee, category, memo, amount "
             "FROM transactions WHERE strftime('%Y', date)=:yr"
         )
-        with indexer.engine.connect() as conn:
+        with dataset.engine.connect() as conn:
             rows_db = conn.execute(q, {"yr": f"{year}"}).fetchall()
 
         if not rows_db:
@@ -146,20 +297,34 @@ async def list_transactions(year: int):
 
 @app.get("/health")
 def health_check():
-    try:
-        response = requests.get(f"{ollama_url}/api/tags", timeout=5)
-        response.raise_for_status()
-        logger.info("Health check OK")
-        return {"status": "ok"}
-    except Exception as e:
-        logger.error("Health check failed: %s", e)
-        raise HTTPException(status_code=503, detail=str(e))
+    errors = []
+    for endpoint in llm_pool.endpoints:
+        try:
+            response = requests.get(f"{endpoint.url}/api/tags", timeout=5)
+            response.raise_for_status()
+        except Exception as e:
+            logger.error("Health check failed for %s: %s", endpoint.url, e)
+            errors.append(f"{endpoint.url}: {e}")
+    if len(errors) == len(llm_pool.endpoints):
+        raise HTTPException(status_code=503, detail="; ".join(errors))
+    logger.info("Health check OK")
+    return {
+        "status": "ok" if not errors else "degraded",
+        "errors": errors,
+        "database": {"role": default_indexer.role, "generation": default_indexer.generation},
+        "datasets": datasets.stats(),
+    }
+
+
+@app.get("/llm/pool")
+def llm_pool_stats():
+    return llm_pool.stats()
 
 
 @app.get("/count")
-async def count_transactions():
+async def count_transactions(dataset: Dataset = Depends(current_dataset)):
     try:
-        with indexer.engine.connect() as conn:
+        with dataset.engine.connect() as conn:
             row = conn.execute(text("SELECT COUNT(*) as cnt FROM transactions")).fetchone()
         count = row[0] if row is not None else 0
         logger.info("Total transactions count: %s", count)
@@ -170,9 +335,9 @@ async def count_transactions():
 
 
 @app.get("/transactions/count/{year}")
-async def count_transactions_year(year: int):
+async def count_transactions_year(year: int, dataset: Dataset = Depends(current_dataset)):
     try:
-        with indexer.engine.connect() as conn:
+        with dataset.engine.connect() as conn:
             row = conn.execute(
                 text("SELECT COUNT(*) FROM transactions WHERE strftime('%Y', date)=:yr"),
                 {"yr": f"{year}"},
@@ -185,27 +350,203 @@ async def count_transactions_year(year: int):
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/chat")
-async def chat(query: Query):
-    user_question = query.question.strip()
-    if not user_question:
-        raise HTTPException(status_code=400, detail="Question cannot be empty.")
+def normalize_question(question: str) -> str:
+    """Canonical form used to recognise the same question asked concurrently."""
+    return re.sub(r"\s+", " ", question).strip().rstrip("?.!").lower()
+
 
-    sql = generate_sql(user_question)
+def fetch_rows(conn, sql: str, params: dict):
+    result = conn.execute(text(sql), params)
+    rows = []
+    for row in result:
+        d = dict(row._mapping)
+        if "date" in d:
+            date_val = d["date"]
+            d["date"] = date_val.isoformat() if hasattr(date_val, "isoformat") else (str(date_val) if date_val else None)
+        amt = d.get("amount")
+        if isinstance(amt, (int, float)):
+            d["amount"] = f"${amt:,.2f}"
+        rows.append(d)
+    return rows
 
+
+def execute_sql(engine, sql: str, params: dict, conn=None):
+    """Run a rewritten statement, on ``conn`` when given or on a fresh ``engine`` connection."""
     try:
-        with indexer.engine.connect() as conn:
-            result = conn.execute(text(sql))
-            rows = []
-            for row in result:
-                d = dict(row._mapping)
-                date_val = d.get("date")
-                d["date"] = date_val.isoformat() if hasattr(date_val, "isoformat") else (str(date_val) if date_val else None)
-                amt = d.get("amount")
-                if isinstance(amt, (int, float)):
-                    d["amount"] = f"${amt:,.2f}"
-                rows.append(d)
-        return {"answer": format_human_readable(rows)}
+        if conn is not None:
+            return fetch_rows(conn, sql, params)
+        with engine.connect() as conn:
+            return fetch_rows(conn, sql, params)
     except Exception as e:
         logger.exception("SQL execution error")
         raise HTTPException(status_code=500, detail=f"SQL execution failed: {e}")
+
+
+def open_snapshot(engine):
+    """
+    Open a connection inside an explicit read transaction so every statement run
+    on it sees the same database state.
+    """
+    conn = engine.connect()
+    conn.exec_driver_sql("BEGIN")
+    return conn
+
+
+def close_snapshot(conn):
+    conn.rollback()
+    conn.close()
+
+
+async def plan_question(dataset: Dataset, question: str):
+    """Turn a question into ``(sql, params)``, from the template cache or the LLM."""
+    template_cache = dataset.template_cache
+    match = await run_in_threadpool(template_cache.match, question)
+    cached = template_cache.lookup(match) if match else None
+    if cached:
+        sql, params = cached
+        logger.info("Reusing SQL template for %r", match.key)
+    else:
+        sql = await run_in_threadpool(generate_sql, question)
+        sql, params = rewrite_sql(sql)
+        if match:
+            template_cache.learn(match, sql, params)
+    logger.info("Planned SQL: %s | params=%s", sql, params)
+    return sql, params
+
+
+async def plan_question_once(dataset: Dataset, question: str):
+    """plan_question, shared with any concurrent request for the same question."""
+    question = question.strip()
+    if not question:
+        raise HTTPException(status_code=400, detail="Question cannot be empty.")
+    return await dataset.question_flight.do(normalize_question(question), lambda: plan_question(dataset, question))
+
+
+@app.post("/chat")
+async def chat(query: Query, dataset: Dataset = Depends(current_dataset)):
+    sql, params = await plan_question_once(dataset, query.question)
+    sql_key = (sql, tuple(sorted(params.items())))
+    rows = await dataset.sql_flight.do(
+        sql_key, lambda: run_in_threadpool(execute_sql, dataset.engine, sql, params)
+    )
+    rows, truncated = cap_rows(rows, params)
+    answer = format_human_readable(rows)
+    if truncated:
+        answer += "\n\n" + truncation_note(rows)
+    return {"answer": answer}
+
+
+@app.post("/chat/stream")
+async def chat_stream(query: Query, dataset: Dataset = Depends(current_dataset)):
+    """
+    Answer a question as NDJSON events so clients can show progress and render
+    large results incrementally:
+
+    - ``{"event": "status", "message": ...}`` while the SQL is planned and run
+    - ``{"event": "columns", "columns": [...]}`` then ``{"event": "rows", "rows": [[...], ...]}`` chunks
+    - ``{"event": "answer", "answer": ..., "truncated": ...}`` with a short human-readable summary;
+      ``truncated`` is true when SQL_ROW_LIMIT cut the result short
+    - ``{"event": "error", "detail": ..., "status_code": ...}`` if anything fails
+    - ``{"event": "done"}`` last
+    """
+
+    async def events():
+        def event(name: str, **payload):
+            return json.dumps({"event": name, **payload}, default=str) + "\n"
+
+        try:
+            yield event("status", message="Generating SQL...")
+            sql, params = await plan_question_once(dataset, query.question)
+            yield event("status", message="Running query...")
+            sql_key = (sql, tuple(sorted(params.items())))
+            rows = await dataset.sql_flight.do(
+                sql_key, lambda: run_in_threadpool(execute_sql, dataset.engine, sql, params)
+            )
+            rows, truncated = cap_rows(rows, params)
+
+            if rows and (len(rows) > 1 or len(rows[0]) > 1):
+                columns = list(rows[0].keys())
+                yield event("columns", columns=columns)
+                for start in range(0, len(rows), STREAM_CHUNK_ROWS):
+                    chunk = rows[start : start + STREAM_CHUNK_ROWS]
+                    yield event("rows", rows=[[row[c] for c in columns] for row in chunk])
+                answer = truncation_note(rows) if truncated else f"Found {len(rows)} row(s)."
+                yield event("answer", answer=answer, truncated=truncated)
+            else:
+                yield event("answer", answer=format_human_readable(rows), truncated=truncated)
+        except HTTPException as e:
+            yield event("error", detail=e.detail, status_code=e.status_code)
+        yield event("done")
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+
+@app.post("/chat/batch")
+async def chat_batch(batch: BatchQuery, dataset: Dataset = Depends(current_dataset)):
+    """
+    Answer several questions at once. SQL is generated concurrently (up to the LLM
+    pool capacity) and every statement runs on one read snapshot, so the answers
+    are consistent with each other. Results come back in question order, or as
+    NDJSON lines in completion order when ``stream`` is set.
+    """
+    limiter = asyncio.Semaphore(llm_pool.capacity)
+
+    async def plan(index: int, question: str):
+        async with limiter:
+            try:
+                return index, await plan_question_once(dataset, question), None
+            except HTTPException as e:
+                return index, None, e
+
+    def result(index: int, planned=None, rows=None, error=None):
+        entry = {"index": index, "question": batch.questions[index]}
+        if error is not None:
+            entry.update(error=error.detail, status_code=error.status_code)
+        else:
+            rows, truncated = cap_rows(rows, planned[1])
+            entry.update(answer=format_human_readable(rows), truncated=truncated)
+        return entry
+
+    tasks = [asyncio.ensure_future(plan(i, q)) for i, q in enumerate(batch.questions)]
+
+    if not batch.stream:
+        plans = await asyncio.gather(*tasks)
+        return {"results": await run_in_threadpool(_execute_batch, dataset.engine, plans, result)}
+
+    async def stream():
+        conn = await run_in_threadpool(open_snapshot, dataset.engine)
+        try:
+            for task in asyncio.as_completed(tasks):
+                index, planned, error = await task
+                if error is None:
+                    try:
+                        rows = await run_in_threadpool(execute_sql, dataset.engine, *planned, conn)
+                        entry = result(index, planned, rows)
+                    except HTTPException as e:
+                        entry = result(index, error=e)
+                else:
+                    entry = result(index, error=error)
+                yield json.dumps(entry) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+            await run_in_threadpool(close_snapshot, conn)
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+def _execute_batch(engine, plans, result):
+    conn = open_snapshot(engine)
+    try:
+        results = []
+        for index, planned, error in plans:
+            if error is None:
+                try:
+                    results.append(result(index, planned, execute_sql(engine, *planned, conn)))
+                    continue
+                except HTTPException as e:
+                    error = e
+            results.append(result(index, error=error))
+        return results
+    finally:
+        close_snapshot(conn)
@@ -1,9 +1,12 @@
+import fcntl
+import json
 import logging
 import os
+import time
 from datetime import date, datetime
 
 import pandas as pd
-from sqlalchemy import Column, Date, Float, MetaData, String, Table, create_engine
+from sqlalchemy import Column, Date, Float, Index, MetaData, String, Table, collate, create_engine
 
 
 class QIFIndexer:
@@ -12,12 +15,15 @@ class QIFIndexer:
         self.db_path = db_path
         self.logger = logging.getLogger("qif_indexer")
         self.logger.setLevel(logging.INFO)
-        sql_echo = os.getenv("SQL_ECHO", "false").lower() in {"1", "true", "yes"}
-        self.engine = create_engine(
-            f"sqlite:///{db_path}",
-            connect_args={"check_same_thread": False},
-            echo=sql_echo,
-        )
+        self.lock_path = f"{db_path}.lock"
+        self.leader_path = f"{db_path}.leader"
+        self.marker_path = f"{db_path}.generation"
+        self.ready_timeout = float(os.getenv("DB_READY_TIMEOUT", "300"))
+        self.role = None
+        self.generation = None
+        self._lock_file = None
+        self._leader_file = None
+        self.engine = self._create_engine(read_only=False)
         self.metadata = MetaData()
         self.transactions = Table(
             "transactions",
@@ -28,6 +34,16 @@ class QIFIndexer:
             Column("memo", String),
             Column("amount", Float),
         )
+        # Match the predicates produced by app.sql_rewriter: date ranges and
+        # case-insensitive comparisons on category/payee.
+        Index("ix_transactions_date", self.transactions.c.date)
+        Index("ix_transactions_category", collate(self.transactions.c.category, "NOCASE"))
+        Index("ix_transactions_payee", collate(self.transactions.c.payee, "NOCASE"))
+
+    def _create_engine(self, read_only: bool):
+        sql_echo = os.getenv("SQL_ECHO", "false").lower() in {"1", "true", "yes"}
+        url = f"sqlite:///file:{self.db_path}?mode=ro&uri=true" if read_only else f"sqlite:///{self.db_path}"
+        return create_engine(url, connect_args={"check_same_thread": False}, echo=sql_echo)
 
     def parse_qif_date(self, qif_date_str):
         """
@@ -133,10 +149,115 @@ class QIFIndexer:
         self.logger.info("Database build complete")
 
     def ensure_database(self):
-        """Ensure the database file exists and is populated."""
-        if not os.path.exists(self.db_path) or os.path.getsize(self.db_path) == 0:
-            self.logger.info("Database file %s missing or empty; creating.", self.db_path)
-            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        """
+        Ensure the database exists and is populated, safely across worker processes.
+
+        Every process sharing ``db_path`` (e.g. ``uvicorn --workers N``) races for an
+        exclusive lock on ``<db_path>.leader``. The winner becomes the leader and
+        keeps that lock, never downgraded, for the life of the process, so there is
+        only ever one writable engine. It builds the database under an exclusive
+        lock on ``<db_path>.lock`` if needed, publishes ``<db_path>.generation`` and
+        keeps a shared lock. The others become read-only followers once they can
+        take a shared lock and see a published generation next to a non-empty
+        database file, i.e. after ingest has finished.
+        """
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        self._lock_file = open(self.lock_path, "a+")
+        self._leader_file = open(self.leader_path, "a+")
+        deadline = time.monotonic() + self.ready_timeout
+        leader = False
+
+        while True:
+            if not leader and self._try_lock(fcntl.LOCK_EX, self._leader_file):
+                leader = True
+                if not self._populated():
+                    # The file was removed to force a re-ingest: retract a stale
+                    # "ready" so no follower attaches before the rebuild starts.
+                    marker = self._read_marker()
+                    self._publish_marker(marker["generation"] if marker else 0, "building")
+            if leader and self._try_lock(fcntl.LOCK_EX):
+                try:
+                    self._lead()
+                finally:
+                    # Downgrade so followers can attach; the shared lock stays held
+                    # for the life of the process. Nobody else can take the exclusive
+                    # lock in between because they cannot hold the leader lock.
+                    fcntl.flock(self._lock_file, fcntl.LOCK_SH)
+                return
+
+            if self._try_lock(fcntl.LOCK_SH):
+                marker = self._read_marker()
+                if marker is not None and marker.get("state") == "ready" and self._populated():
+                    if not leader:
+                        self._follow(marker)
+                        return
+                    # Followers outlived the previous leader: the database is
+                    # complete, so take over without rebuilding under them.
+                    self._lead()
+                    return
+                # Ingest has not finished (or the previous leader died before
+                # publishing); release the lock so the leader can build, then retry.
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Timed out waiting for database ingest of {self.db_path}")
+            time.sleep(0.5)
+
+    def close(self):
+        """Dispose of pooled connections and release the ingest and leader locks."""
+        self.engine.dispose()
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+        if self._leader_file is not None:
+            self._leader_file.close()
+            self._leader_file = None
+
+    def _lead(self):
+        self.role = "leader"
+        marker = self._read_marker()
+        generation = marker["generation"] if marker else 0
+        interrupted = marker is not None and marker.get("state") != "ready"
+        if not self._populated() or interrupted:
+            self.logger.info("Database file %s missing, empty or half-built; creating.", self.db_path)
+            generation += 1
+            self._publish_marker(generation, "building")
             self.build_database()
         else:
             self.logger.info("Database file %s already exists and is populated.", self.db_path)
+            # Databases built before the indexes existed get them added in place.
+            for index in self.transactions.indexes:
+                index.create(self.engine, checkfirst=True)
+        self._publish_marker(generation, "ready")
+        self.generation = generation
+        self.logger.info("Ingest leader (pid %s) published generation %s", os.getpid(), generation)
+
+    def _follow(self, marker: dict):
+        self.role = "follower"
+        self.generation = marker["generation"]
+        self.engine.dispose()
+        self.engine = self._create_engine(read_only=True)
+        self.logger.info("Read-only follower (pid %s) serving generation %s", os.getpid(), self.generation)
+
+    def _populated(self) -> bool:
+        return os.path.exists(self.db_path) and os.path.getsize(self.db_path) > 0
+
+    def _try_lock(self, mode, lock_file=None) -> bool:
+        try:
+            fcntl.flock(lock_file or self._lock_file, mode | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            return False
+
+    def _read_marker(self):
+        try:
+            with open(self.marker_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _publish_marker(self, generation: int, state: str):
+        tmp_path = f"{self.marker_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"generation": generation, "state": state, "pid": os.getpid(), "published_at": time.time()}, f)
+        os.replace(tmp_path, self.marker_path)
@@ -0,0 +1,53 @@
+import asyncio
+import logging
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls that share a key onto one in-flight task.
+
+    The first caller for a key starts the work; callers arriving while it runs
+    await the same task and receive its result or its exception. A caller being
+    cancelled does not cancel the shared work unless it was the last one waiting.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.logger = logging.getLogger("singleflight")
+        self._calls = {}
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key, fn):
+        """Run ``fn()`` (a coroutine factory) once for all concurrent callers of ``key``."""
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _task: self._forget(key, call))
+        else:
+            self.logger.info("%s: joined in-flight call (%s waiting)", self.name, call.waiters + 1)
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # Nobody is left to receive the result; stop the work and make
+                # sure a new caller starts fresh rather than joining a dying task.
+                self._forget(key, call)
+                call.task.cancel()
+
+    def _forget(self, key, call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+
+class _Call:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
@@ -0,0 +1,235 @@
+import os
+import re
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import ParseError
+
+TRANSACTION_COLUMNS = ["date", "payee", "category", "memo", "amount"]
+
+# Optional cap on rows returned by non-aggregate queries that have no LIMIT of
+# their own. Off by default (0). When set, the statement fetches one extra row
+# bound as :row_limit so callers can tell the answer was truncated.
+row_limit = int(os.getenv("SQL_ROW_LIMIT", "0"))
+ROW_LIMIT_PARAM = "row_limit"
+
+_SET_OPERATIONS = tuple(
+    getattr(exp, name) for name in ("SetOperation", "Union", "Intersect", "Except") if hasattr(exp, name)
+)
+_BLOCKED_NODES = tuple(
+    getattr(exp, name)
+    for name in ("Insert", "Update", "Delete", "Drop", "Alter", "AlterTable", "Create", "Pragma", "Command", "Merge")
+    if hasattr(exp, name)
+)
+_BLOCKED_FUNCTIONS = {"load_extension", "readfile", "writefile"}
+# Only operands of these are bound; ordinals (GROUP BY 1) and other literals stay inline.
+_COMPARISONS = (exp.EQ, exp.NEQ, exp.GT, exp.GTE, exp.LT, exp.LTE, exp.Like, exp.ILike, exp.Between, exp.In)
+
+
+def parse_select(sql: str) -> exp.Expression:
+    """
+    Parse ``sql`` as SQLite and return the AST of its single read-only statement.
+    Raises ValueError when the text is not exactly one SELECT.
+    """
+    try:
+        statements = [s for s in sqlglot.parse(sql, read="sqlite") if s is not None]
+    except ParseError as e:
+        raise ValueError(f"Generated SQL could not be parsed: {e}") from e
+
+    if not statements:
+        raise ValueError("No SQL was generated by the LLM.")
+    if len(statements) > 1:
+        raise ValueError("Multiple SQL statements are not allowed.")
+
+    statement = statements[0]
+    if not isinstance(statement, (exp.Select, *_SET_OPERATIONS)):
+        raise ValueError(f"Only SELECT is allowed. SQL: {sql}")
+    for node in statement.walk():
+        node = node[0] if isinstance(node, tuple) else node
+        if isinstance(node, _BLOCKED_NODES):
+            raise ValueError("Generated SQL contains blocked keywords.")
+        if isinstance(node, exp.Func) and node.name.lower() in _BLOCKED_FUNCTIONS:
+            raise ValueError("Generated SQL contains blocked keywords.")
+    return statement
+
+
+def rewrite_sql(sql: str):
+    """
+    Rewrite a sanitized SELECT into an index-friendly, parameterized statement.
+
+    Returns ``(sql, params)`` where literals in predicates are replaced by named
+    bind parameters, so questions that differ only in their values share one
+    statement shape. ``params`` holds ROW_LIMIT_PARAM when the row cap was applied.
+    """
+    tree = parse_select(sql)
+    tree = tree.transform(_sargable_dates)
+    tree = tree.transform(_nocase_comparisons)
+    _expand_star(tree)
+    _prune_subquery_projections(tree)
+    params = _parameterize(tree)
+    if _apply_row_limit(tree):
+        params[ROW_LIMIT_PARAM] = row_limit + 1
+    return tree.sql(dialect="sqlite"), params
+
+
+def cap_rows(rows: list, params: dict):
+    """Trim the extra row fetched by the row cap; return ``(rows, truncated)``."""
+    limit = params.get(ROW_LIMIT_PARAM)
+    if limit is not None and len(rows) >= limit:
+        return rows[: limit - 1], True
+    return rows, False
+
+
+def year_bounds(year: int):
+    return f"{year:04d}-01-01", f"{year + 1:04d}-01-01"
+
+
+def month_bounds(year: int, month: int):
+    end_year, end_month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return f"{year:04d}-{month:02d}-01", f"{end_year:04d}-{end_month:02d}-01"
+
+
+def _strftime_parts(node):
+    """Return ``(format, column)`` if ``node`` is ``strftime(<literal>, <column>)``."""
+    if isinstance(node, exp.TimeToStr):
+        fmt, target = node.args.get("format"), node.this
+        while isinstance(target, (exp.TsOrDsToTimestamp, exp.TsOrDsToDate, exp.Cast)):
+            target = target.this
+    elif isinstance(node, exp.Anonymous) and node.name.lower() == "strftime" and len(node.expressions) == 2:
+        fmt, target = node.expressions
+    else:
+        return None
+    if isinstance(fmt, exp.Literal) and fmt.is_string and isinstance(target, exp.Column):
+        return fmt.this, target
+    return None
+
+
+def _sargable_dates(node):
+    """``strftime('%Y', date) = '2018'`` -> ``date >= '2018-01-01' AND date < '2019-01-01'``."""
+    if not isinstance(node, exp.EQ):
+        return node
+    for func, value in ((node.this, node.expression), (node.expression, node.this)):
+        parts = _strftime_parts(func)
+        if not parts or not isinstance(value, exp.Literal) or not value.is_string:
+            continue
+        fmt, column = parts
+        if fmt == "%Y" and re.fullmatch(r"\d{4}", value.this):
+            start, end = year_bounds(int(value.this))
+        elif fmt == "%Y-%m" and re.fullmatch(r"\d{4}-(0[1-9]|1[0-2])", value.this):
+            start, end = month_bounds(int(value.this[:4]), int(value.this[5:]))
+        else:
+            continue
+        return exp.Paren(
+            this=exp.and_(
+                exp.GTE(this=column.copy(), expression=exp.Literal.string(start)),
+                exp.LT(this=column.copy(), expression=exp.Literal.string(end)),
+            )
+        )
+    return node
+
+
+def _nocase_comparisons(node):
+    """
+    Drop ``LOWER()``/``UPPER()`` wrappers from columns so the comparison can use
+    an index. LIKE already ignores ASCII case in SQLite; equality gets COLLATE NOCASE.
+    """
+    if not isinstance(node, (exp.Like, exp.EQ)):
+        return node
+    wrapped, value = node.this, node.expression
+    if not isinstance(wrapped, (exp.Lower, exp.Upper)) or not isinstance(wrapped.this, exp.Column):
+        return node
+    if not isinstance(value, exp.Literal) or not value.is_string:
+        return node
+
+    if isinstance(node, exp.Like):
+        return exp.Like(this=wrapped.this.copy(), expression=value.copy())
+    # LOWER(col) = 'Mixed' never matches; only rewrite when the result is equivalent.
+    folded = value.this.lower() if isinstance(wrapped, exp.Lower) else value.this.upper()
+    if folded != value.this:
+        return node
+    return exp.EQ(
+        this=wrapped.this.copy(),
+        expression=exp.Collate(this=value.copy(), expression=exp.Var(this="NOCASE")),
+    )
+
+
+def _expand_star(tree):
+    """Replace ``SELECT *`` over the transactions table with its explicit column list."""
+    for select in tree.find_all(exp.Select):
+        if len(select.expressions) != 1 or not isinstance(select.expressions[0], exp.Star):
+            continue
+        sources = [t for t in select.find_all(exp.Table) if t.parent_select is select]
+        if len(sources) != 1 or sources[0].name.lower() != "transactions" or select.args.get("joins"):
+            continue
+        select.set("expressions", [exp.column(name) for name in TRANSACTION_COLUMNS])
+
+
+def _prune_subquery_projections(tree):
+    """Drop derived-table columns the enclosing query never references."""
+    for select in tree.find_all(exp.Select):
+        if any(isinstance(e, exp.Star) or e.find(exp.Star) for e in select.expressions):
+            continue
+        outer = {c.name.lower() for c in select.find_all(exp.Column) if c.parent_select is select}
+        for subquery in select.find_all(exp.Subquery):
+            inner = subquery.this
+            if subquery.parent_select is not select or not subquery.alias or not isinstance(inner, exp.Select):
+                continue
+            if inner.args.get("distinct") or inner.args.get("group"):
+                continue
+            # Aliases may also be used by the subquery's own ORDER BY / WHERE.
+            projected = {id(c) for e in inner.expressions for c in e.find_all(exp.Column)}
+            referenced = outer | {c.name.lower() for c in inner.find_all(exp.Column) if id(c) not in projected}
+            kept = [e for e in inner.expressions if e.alias_or_name.lower() in referenced]
+            if kept and len(kept) < len(inner.expressions):
+                inner.set("expressions", kept)
+
+
+def _apply_row_limit(tree) -> bool:
+    if row_limit <= 0 or not isinstance(tree, exp.Select) or tree.args.get("limit"):
+        return False
+    if tree.args.get("group") or any(e.find(exp.AggFunc) for e in tree.expressions):
+        return False
+    tree.limit(exp.Placeholder(this=ROW_LIMIT_PARAM), copy=False)
+    return True
+
+
+def _parameterize(tree):
+    """Replace predicate literals with ``:pN`` placeholders and return their values."""
+    params = {}
+    for clause in (exp.Where, exp.Having, exp.Join):
+        for node in list(tree.find_all(clause)):
+            for literal in list(node.find_all(exp.Literal, bfs=False)):
+                if not _is_operand(literal, node):
+                    continue
+                name = f"p{len(params)}"
+                if literal.is_string:
+                    params[name] = literal.this
+                elif isinstance(literal.parent, exp.Neg):
+                    params[name] = -_number(literal.this)
+                    literal = literal.parent
+                else:
+                    params[name] = _number(literal.this)
+                literal.replace(exp.Placeholder(this=name))
+    return params
+
+
+def _is_operand(literal, clause) -> bool:
+    """True if ``literal`` is a comparison operand outside any projection, GROUP BY or ORDER BY."""
+    operand = literal.parent.parent if isinstance(literal.parent, (exp.Neg, exp.Collate)) else literal.parent
+    if not isinstance(operand, _COMPARISONS):
+        return False
+    node = literal
+    while node is not clause:
+        if isinstance(node, (exp.Group, exp.Order, exp.Ordered, exp.Limit)):
+            return False
+        if isinstance(node.parent, exp.Select) and node.arg_key == "expressions":
+            return False
+        node = node.parent
+    return True
+
+
+def _number(value: str):
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
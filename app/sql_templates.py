@@ -0,0 +1,303 @@
+import calendar
+import logging
+import re
+import threading
+from collections import OrderedDict
+from itertools import combinations
+
+from sqlalchemy import text
+
+from app.sql_rewriter import ROW_LIMIT_PARAM, month_bounds, year_bounds
+
+MONTHS = {
+    name: number
+    for number, name in enumerate(
+        [
+            "january", "february", "march", "april", "may", "june",
+            "july", "august", "september", "october", "november", "december",
+        ],
+        start=1,
+    )
+}
+
+# Words that also happen to be category/payee names (or parts of them) but are
+# far more likely to be part of the question itself.
+STOPWORDS = {
+    "all", "and", "any", "are", "average", "by", "category", "count", "date", "each", "for", "from",
+    "how", "list", "many", "memo", "month", "much", "payee", "show", "spent", "sum", "the", "total",
+    "transaction", "transactions", "what", "where", "which", "with", "year",
+}
+
+_YEAR_RE = r"\b(?P<year>(?:19|20)\d{2})\b"
+_AMOUNT_RE = r"(?P<amount>\$\s?\d[\d,]*(?:\.\d+)?|\b\d[\d,]*\.\d+\b)"
+# "may" only counts as a month when a year follows it ("May 2018").
+_MONTH_RE = (
+    r"\b(?P<month>" + "|".join(m for m in MONTHS if m != "may") + r"|may(?=,?\s+(?:19|20)\d{2}\b))\b"
+)
+_QUOTED_RE = r"(?P<quoted>'[^']+'|\"[^\"]+\")"
+
+
+class TemplateMatch:
+    """A question split into its canonical template key and the literal slots pulled out of it."""
+
+    def __init__(self, key: str, slots: list):
+        self.key = key
+        # Each slot is (kind, value); kind is year, month, amount, category or payee.
+        self.slots = slots
+
+
+class SQLTemplateCache:
+    """
+    Reuse generated SQL across questions that differ only in their literals.
+
+    "Total Dues in 2018" and "total Utilities in 2021" both reduce to the key
+    ``total <category> in <year>``. The SQL generated for the first one is kept
+    with each bind parameter traced back to the question slot it came from, so
+    the second question can be answered by substituting its own values. Anything
+    that cannot be traced unambiguously is not cached and goes to the LLM.
+    """
+
+    def __init__(self, engine, max_size: int = 256):
+        self.engine = engine
+        self.max_size = max_size
+        self.logger = logging.getLogger("sql_templates")
+        self._lock = threading.Lock()
+        self._templates = OrderedDict()
+        self._vocabulary = None
+        self._values = None
+        self._terms_re = None
+
+    def match(self, question: str):
+        """Return the TemplateMatch for ``question``, or None if it has no usable slots."""
+        self._load_vocabulary()
+        pattern = "|".join((_QUOTED_RE, _AMOUNT_RE, _YEAR_RE, _MONTH_RE))
+        if self._terms_re:
+            pattern += "|" + self._terms_re
+        slots = []
+        parts = []
+        last = 0
+        for m in re.finditer(pattern, question, flags=re.IGNORECASE):
+            kind, value = self._slot(m)
+            if kind is None:
+                return None
+            parts.append(question[last : m.start()])
+            parts.append(f"<{kind}>")
+            slots.append((kind, value))
+            last = m.end()
+        if not slots:
+            return None
+        parts.append(question[last:])
+        key = re.sub(r"\s+", " ", "".join(parts)).strip().rstrip("?.!").lower()
+        return TemplateMatch(key, slots)
+
+    def lookup(self, match: TemplateMatch):
+        """Return ``(sql, params)`` for a cached template, or None when it must go to the LLM."""
+        with self._lock:
+            template = self._templates.get(match.key)
+            if template is None:
+                return None
+            self._templates.move_to_end(match.key)
+        sql, constants, bindings, order = template
+        if _slot_order(match.slots, bindings) != order:
+            # "2019 and 2018" against a template learned from "2018 and 2019":
+            # the bounds would come out reversed and match nothing.
+            self.logger.info("Template %r: literals are in a different order; using the LLM", match.key)
+            return None
+
+        params = dict(constants)
+        for name, derivation in bindings.items():
+            value = _render(derivation, match.slots)
+            if derivation[0] == "term" and not self._known_pattern(match.slots[derivation[1][0]][0], value):
+                self.logger.info("Template %r: %r matches no known value; using the LLM", match.key, value)
+                return None
+            params[name] = value
+        return sql, params
+
+    def learn(self, match: TemplateMatch, sql: str, params: dict):
+        """Cache ``sql`` for ``match.key`` if every slot maps onto its parameters unambiguously."""
+        lowered_sql = sql.lower()
+        for kind, value in match.slots:
+            if kind in {"year", "category", "payee"} and _slot_text(kind, value).lower() in lowered_sql:
+                return  # the literal is baked into the statement itself
+
+        constants = {}
+        bindings = {}
+        for name, value in params.items():
+            candidates = [] if name == ROW_LIMIT_PARAM else _derivations(value, match.slots)
+            if len(candidates) > 1:
+                self.logger.info("Template %r: parameter %s is ambiguous; not cached", match.key, name)
+                return
+            if candidates:
+                bindings[name] = candidates[0]
+            elif _mentions_slot(value, match.slots):
+                # e.g. the '2018-12-31' end of a BETWEEN: freezing it would answer the
+                # next year's question with this year's range.
+                self.logger.info("Template %r: parameter %s embeds a literal; not cached", match.key, name)
+                return
+            else:
+                constants[name] = value
+
+        bound = {index for derivation in bindings.values() for index in derivation[1]}
+        if bound != set(range(len(match.slots))):
+            self.logger.info("Template %r: not every literal reached the SQL; not cached", match.key)
+            return
+
+        with self._lock:
+            self._templates[match.key] = (sql, constants, bindings, _slot_order(match.slots, bindings))
+            self._templates.move_to_end(match.key)
+            while len(self._templates) > self.max_size:
+                self._templates.popitem(last=False)
+        self.logger.info("Cached SQL template for %r", match.key)
+
+    def _slot(self, m):
+        groups = m.groupdict()
+        if groups.get("quoted"):
+            return self._term_slot(groups["quoted"][1:-1])
+        if groups.get("amount"):
+            return "amount", float(re.sub(r"[$,\s]", "", groups["amount"]))
+        if groups.get("year"):
+            return "year", int(groups["year"])
+        if groups.get("month"):
+            return "month", MONTHS[groups["month"].lower()]
+        return self._term_slot(m.group(0))
+
+    def _term_slot(self, term: str):
+        kinds = self._vocabulary.get(term.lower(), {})
+        if len(kinds) != 1:
+            # Unknown, or both a category and a payee: substitution would be a guess.
+            return None, None
+        kind, canonical = next(iter(kinds.items()))
+        return kind, canonical
+
+    def _known_pattern(self, kind: str, value) -> bool:
+        if not isinstance(value, str):
+            return False
+        pattern = re.escape(value).replace("%", ".*").replace("_", ".")
+        return any(re.fullmatch(pattern, known, flags=re.IGNORECASE | re.DOTALL) for known in self._values[kind])
+
+    def _load_vocabulary(self):
+        """Read the distinct categories and payees once; terms are full values and ``:`` parts."""
+        with self._lock:
+            if self._vocabulary is not None:
+                return
+            vocabulary = {}
+            values = {}
+            with self.engine.connect() as conn:
+                for kind in ("category", "payee"):
+                    rows = conn.execute(text(f"SELECT DISTINCT {kind} FROM transactions WHERE {kind} <> ''"))
+                    values[kind] = [row[0] for row in rows if row[0]]
+            for kind, known in values.items():
+                for value in known:
+                    for term in {value, *value.split(":")}:
+                        term = term.strip()
+                        if len(term) < 3 or term.lower() in STOPWORDS or term.isdigit():
+                            continue
+                        vocabulary.setdefault(term.lower(), {}).setdefault(kind, term)
+            terms = sorted(vocabulary, key=len, reverse=True)
+            self._terms_re = (
+                r"(?<!\w)(?:" + "|".join(re.escape(t) for t in terms) + r")(?!\w)" if terms else None
+            )
+            self._values = values
+            self._vocabulary = vocabulary
+            self.logger.info("Loaded %s category/payee terms for template matching", len(vocabulary))
+
+
+def _slot_text(kind: str, value) -> str:
+    return str(value) if kind == "year" else value
+
+
+def _last_day(year: int, month: int) -> str:
+    return f"{year:04d}-{month:02d}-{calendar.monthrange(year, month)[1]:02d}"
+
+
+def _mentions_slot(value, slots) -> bool:
+    """True if the string ``value`` contains the text of a year or category/payee slot."""
+    if not isinstance(value, str):
+        return False
+    lowered = value.lower()
+    for kind, slot in slots:
+        if kind == "year":
+            if str(slot) in lowered:
+                return True
+        elif kind in {"category", "payee"} and slot.lower() in lowered:
+            return True
+    return False
+
+
+def _slot_order(slots, bindings):
+    """How bound year, month and amount slots compare with others of their kind, pair by pair."""
+    bound = sorted({index for derivation in bindings.values() for index in derivation[1]})
+    order = []
+    for kind in ("year", "month", "amount"):
+        values = [slots[i][1] for i in bound if slots[i][0] == kind]
+        order.extend((a > b) - (a < b) for a, b in combinations(values, 2))
+    return tuple(order)
+
+
+def _derivations(value, slots):
+    """List every way ``value`` could have been produced from the question's slots."""
+    found = []
+    for i, (kind, slot) in enumerate(slots):
+        if kind == "year":
+            if value == str(slot) or (isinstance(value, int) and value == slot):
+                found.append(("year", (i,), type(value).__name__))
+            for k, bound in enumerate(year_bounds(slot)):
+                if value == bound:
+                    found.append(("year_bound", (i,), k))
+            if value == _last_day(slot, 12):
+                found.append(("year_last_day", (i,), None))
+            for j, (other_kind, month) in enumerate(slots):
+                if other_kind != "month":
+                    continue
+                for k, bound in enumerate(month_bounds(slot, month)):
+                    if value == bound:
+                        found.append(("month_bound", (i, j), k))
+                if value == _last_day(slot, month):
+                    found.append(("month_last_day", (i, j), None))
+                if value == f"{slot:04d}-{month:02d}":
+                    found.append(("year_month", (i, j), None))
+        elif kind == "month":
+            if value == f"{slot:02d}":
+                found.append(("month", (i,), None))
+        elif kind == "amount":
+            if isinstance(value, (int, float)) and abs(value) == slot:
+                found.append(("amount", (i,), (1 if value >= 0 else -1, type(value).__name__)))
+        elif isinstance(value, str):
+            lowered = value.lower()
+            start = lowered.find(slot.lower())
+            if start >= 0 and lowered.count(slot.lower()) == 1:
+                matched = value[start : start + len(slot)]
+                case = "canonical"
+                if matched != slot and matched == slot.lower():
+                    case = "lower"
+                elif matched != slot and matched == slot.upper():
+                    case = "upper"
+                found.append(("term", (i,), (value[:start], value[start + len(slot) :], case)))
+    return found
+
+
+def _render(derivation, slots):
+    """Rebuild a parameter value from ``derivation`` using the new question's slots."""
+    kind, indexes, extra = derivation
+    values = [slots[i][1] for i in indexes]
+    if kind == "year":
+        return values[0] if extra == "int" else str(values[0])
+    if kind == "year_bound":
+        return year_bounds(values[0])[extra]
+    if kind == "month_bound":
+        return month_bounds(values[0], values[1])[extra]
+    if kind == "year_last_day":
+        return _last_day(values[0], 12)
+    if kind == "month_last_day":
+        return _last_day(values[0], values[1])
+    if kind == "year_month":
+        return f"{values[0]:04d}-{values[1]:02d}"
+    if kind == "month":
+        return f"{values[0]:02d}"
+    if kind == "amount":
+        sign, type_name = extra
+        amount = sign * values[0]
+        return int(amount) if type_name == "int" and amount == int(amount) else amount
+    prefix, suffix, case = extra
+    term = values[0].lower() if case == "lower" else values[0].upper() if case == "upper" else values[0]
+    return f"{prefix}{term}{suffix}"
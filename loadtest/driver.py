@@ -0,0 +1,167 @@
+"""
+Load driver for the QIF agent backend.
+
+Runs a weighted mix of ``POST /chat``, ``GET /transactions/{year}`` and
+``GET /count`` requests at each requested concurrency level and reports
+throughput, p50/p95/p99 latency and error rate per endpoint.
+
+    python -m loadtest.driver --base-url http://localhost:8000 --concurrency 1,4,16 --duration 30
+"""
+import argparse
+import json
+import math
+import random
+import threading
+import time
+
+import requests
+
+DEFAULT_QUESTIONS = [
+    "What is the sum total for all of {year} where the category like Dues?",
+    "List all transactions from {year} where category like Util or like Electric",
+    "Total spending by category in {year}",
+    "Which payees did I pay most often in {year}?",
+    "Monthly totals for {year}",
+    "How many transactions were there in {year}?",
+    "Show my Amazon purchases",
+    "What was my largest transaction?",
+]
+
+
+class Result:
+    __slots__ = ("endpoint", "latency", "ok", "status")
+
+    def __init__(self, endpoint: str, latency: float, ok: bool, status):
+        self.endpoint = endpoint
+        self.latency = latency
+        self.ok = ok
+        self.status = status
+
+
+def percentile(sorted_values, pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(pct / 100 * len(sorted_values))
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+
+def make_request(session, base_url: str, endpoint: str, rng: random.Random, questions, years, timeout: float):
+    year = rng.choice(years)
+    if endpoint == "chat":
+        question = rng.choice(questions).replace("{year}", str(year))
+        return session.post(f"{base_url}/chat", json={"question": question}, timeout=timeout)
+    if endpoint == "transactions":
+        return session.get(f"{base_url}/transactions/{year}", timeout=timeout)
+    return session.get(f"{base_url}/count", timeout=timeout)
+
+
+def run_level(args, concurrency: int, mix, questions, years):
+    """Drive ``concurrency`` workers for ``args.duration`` seconds and return their results."""
+    endpoints, weights = zip(*mix.items())
+    results = []
+    results_lock = threading.Lock()
+    deadline = time.monotonic() + args.duration
+
+    def worker(seed: int):
+        rng = random.Random(seed)
+        session = requests.Session()
+        local = []
+        while time.monotonic() < deadline:
+            endpoint = rng.choices(endpoints, weights=weights)[0]
+            started = time.monotonic()
+            try:
+                resp = make_request(session, args.base_url, endpoint, rng, questions, years, args.timeout)
+                local.append(Result(endpoint, time.monotonic() - started, resp.status_code == 200, resp.status_code))
+            except requests.RequestException as e:
+                local.append(Result(endpoint, time.monotonic() - started, False, type(e).__name__))
+        with results_lock:
+            results.extend(local)
+
+    threads = [threading.Thread(target=worker, args=(args.seed + i,), daemon=True) for i in range(concurrency)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.monotonic() - started
+
+
+def summarize(results, elapsed: float):
+    summary = {}
+    groups = {"all": results}
+    for result in results:
+        groups.setdefault(result.endpoint, []).append(result)
+    for name, group in groups.items():
+        latencies = sorted(r.latency for r in group)
+        errors = [r for r in group if not r.ok]
+        statuses = {}
+        for r in errors:
+            statuses[str(r.status)] = statuses.get(str(r.status), 0) + 1
+        summary[name] = {
+            "requests": len(group),
+            "throughput_rps": len(group) / elapsed if elapsed else 0.0,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p95_ms": percentile(latencies, 95) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+            "error_rate": len(errors) / len(group) if group else 0.0,
+            "errors": statuses,
+        }
+    return summary
+
+
+def print_report(concurrency: int, summary: dict):
+    print(f"\nconcurrency={concurrency}")
+    print(f"{'endpoint':<14}{'requests':>9}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>9}")
+    for name, s in sorted(summary.items(), key=lambda item: item[0] != "all"):
+        print(
+            f"{name:<14}{s['requests']:>9}{s['throughput_rps']:>9.1f}{s['p50_ms']:>10.1f}"
+            f"{s['p95_ms']:>10.1f}{s['p99_ms']:>10.1f}{s['error_rate']:>8.1%}"
+        )
+        if s["errors"]:
+            print(f"{'':<14}errors by status: {s['errors']}")
+
+
+def parse_mix(value: str):
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name not in {"chat", "transactions", "count"}:
+            raise argparse.ArgumentTypeError(f"unknown endpoint in mix: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", default="1,4,16", help="comma-separated concurrency levels")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds per concurrency level")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("chat=6,transactions=3,count=1"))
+    parser.add_argument("--questions", help="file with one question per line; {year} is substituted")
+    parser.add_argument("--years", default="2018,2019,2020,2021,2022,2023,2024")
+    parser.add_argument("--timeout", type=float, default=90.0, help="client timeout per request in seconds")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", dest="json_path", help="also write the full report to this JSON file")
+    args = parser.parse_args(argv)
+
+    questions = DEFAULT_QUESTIONS
+    if args.questions:
+        with open(args.questions, "r", encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+    years = [int(y) for y in args.years.split(",")]
+
+    report = {}
+    for concurrency in (int(c) for c in args.concurrency.split(",")):
+        results, elapsed = run_level(args, concurrency, args.mix, questions, years)
+        summary = summarize(results, elapsed)
+        report[str(concurrency)] = summary
+        print_report(concurrency, summary)
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
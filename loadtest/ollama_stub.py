@@ -0,0 +1,183 @@
+"""
+Ollama-compatible stub server for load testing without a real model.
+
+Serves ``GET /api/tags`` and a streaming ``POST /api/generate``. Each response
+is drawn (by weight) from a JSON corpus of realistic LLM output, split into
+word-sized tokens and streamed with a configurable per-token latency. The
+``num_predict`` and ``stop`` options are honoured like Ollama does, and a
+share of requests can be made to fail or hang.
+
+    python -m loadtest.ollama_stub --port 11434 --token-latency 0.02 --error-rate 0.01
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(__file__), "sql_corpus.json")
+
+logger = logging.getLogger("ollama_stub")
+
+
+class StubConfig:
+    def __init__(self, corpus, token_latency: float, latency_jitter: float, error_rate: float,
+                 timeout_rate: float, hang_seconds: float, years, seed=None):
+        self.corpus = corpus
+        self.weights = [entry.get("weight", 1) for entry in corpus]
+        self.token_latency = token_latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.hang_seconds = hang_seconds
+        self.years = years
+        self.random = random.Random(seed)
+
+    def pick_response(self, prompt: str) -> str:
+        entry = self.random.choices(self.corpus, weights=self.weights)[0]
+        question = prompt.rsplit("Question:", 1)[-1]
+        year = re.search(r"\b(?:19|20)\d{2}\b", question)
+        return entry["response"].replace("{year}", year.group(0) if year else str(self.random.choice(self.years)))
+
+    def token_delay(self) -> float:
+        return max(0.0, self.random.gauss(self.token_latency, self.latency_jitter))
+
+
+def tokenize(response: str):
+    """Split text roughly the way an LLM streams it: words, whitespace and punctuation."""
+    return re.findall(r"\s+|\w+|[^\w\s]", response)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config: StubConfig = None
+
+    def do_GET(self):
+        if self.path.rstrip("/") != "/api/tags":
+            self._send_json(404, {"error": "not found"})
+            return
+        self._send_json(200, {"models": [{"name": "stub:latest", "model": "stub:latest"}]})
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/api/generate":
+            self._send_json(404, {"error": "not found"})
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+
+        roll = self.config.random.random()
+        if roll < self.config.error_rate:
+            self._send_json(500, {"error": "injected failure"})
+            return
+        if roll < self.config.error_rate + self.config.timeout_rate:
+            time.sleep(self.config.hang_seconds)
+            self._send_json(500, {"error": "injected timeout"})
+            return
+
+        self._stream(body)
+
+    def _stream(self, body: dict):
+        options = body.get("options") or {}
+        num_predict = options.get("num_predict") or -1
+        stops = options.get("stop") or []
+        response = self.config.pick_response(body.get("prompt", ""))
+
+        # Ollama ends generation at the first stop sequence, without emitting it.
+        for stop in stops:
+            index = response.find(stop)
+            if index >= 0:
+                response = response[:index]
+        tokens = tokenize(response)
+        if num_predict > 0:
+            tokens = tokens[:num_predict]
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        started = time.monotonic()
+        sent = 0
+        try:
+            for token in tokens:
+                time.sleep(self.config.token_delay())
+                self._write_chunk({"model": body.get("model"), "response": token, "done": False})
+                sent += 1
+            self._write_chunk(
+                {
+                    "model": body.get("model"),
+                    "response": "",
+                    "done": True,
+                    "eval_count": sent,
+                    "eval_duration": int((time.monotonic() - started) * 1e9),
+                }
+            )
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            logger.debug("Client closed the stream after %s of %s tokens", sent, len(tokens))
+
+    def _write_chunk(self, obj: dict):
+        line = (json.dumps(obj) + "\n").encode("utf-8")
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+        self.wfile.flush()
+
+    def _send_json(self, status: int, obj: dict):
+        payload = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+def build_server(host: str, port: int, config: StubConfig) -> ThreadingHTTPServer:
+    handler = type("ConfiguredStubHandler", (StubHandler,), {"config": config})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="JSON list of {weight, response} entries")
+    parser.add_argument("--token-latency", type=float, default=0.02, help="mean seconds per streamed token")
+    parser.add_argument("--latency-jitter", type=float, default=0.005, help="std-dev of the per-token latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with HTTP 500")
+    parser.add_argument("--timeout-rate", type=float, default=0.0, help="share of requests that hang")
+    parser.add_argument("--hang-seconds", type=float, default=90.0, help="how long a hanging request stalls")
+    parser.add_argument("--years", default="2018,2019,2020,2021,2022,2023,2024")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+    with open(args.corpus, "r", encoding="utf-8") as f:
+        corpus = json.load(f)
+    config = StubConfig(
+        corpus,
+        token_latency=args.token_latency,
+        latency_jitter=args.latency_jitter,
+        error_rate=args.error_rate,
+        timeout_rate=args.timeout_rate,
+        hang_seconds=args.hang_seconds,
+        years=[int(y) for y in args.years.split(",")],
+        seed=args.seed,
+    )
+    server = build_server(args.host, args.port, config)
+    logger.info("Ollama stub listening on http://%s:%s (%s corpus entries)", args.host, args.port, len(corpus))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
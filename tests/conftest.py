@@ -0,0 +1,41 @@
+import os
+import tempfile
+import threading
+
+import pytest
+
+# app.main ingests the default dataset at import time; point it at a scratch directory.
+_scratch = tempfile.mkdtemp(prefix="qif-agent-tests-")
+os.environ.setdefault("QIF_DIR", os.path.join(_scratch, "qifs"))
+os.environ.setdefault("DB_PATH", os.path.join(_scratch, "db", "transactions.db"))
+
+from loadtest.ollama_stub import StubConfig, build_server  # noqa: E402
+
+STUB_SQL = "SELECT COUNT(*) AS transaction_count FROM transactions WHERE strftime('%Y', date) = '{year}';"
+
+
+@pytest.fixture
+def ollama_stub():
+    """Factory for Ollama stub servers; returns ``(url, config)`` and stops them afterwards."""
+    servers = []
+
+    def start(error_rate: float = 0.0, token_latency: float = 0.0, response: str = STUB_SQL):
+        config = StubConfig(
+            [{"weight": 1, "response": response}],
+            token_latency=token_latency,
+            latency_jitter=0.0,
+            error_rate=error_rate,
+            timeout_rate=0.0,
+            hang_seconds=0.0,
+            years=[2018],
+            seed=1,
+        )
+        server = build_server("127.0.0.1", 0, config)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}", config
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,65 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import main
+from app.datasets import DEFAULT_DATASET
+from app.llm_pool import Endpoint, LLMPool
+from app.sql_templates import SQLTemplateCache
+
+QUESTIONS = [
+    "How many transactions were there in 2018?",
+    "   ",
+    "How many transactions were there in 2018?",
+    "Count the transactions booked in 2019",
+]
+
+
+@pytest.fixture
+def pool(ollama_stub, monkeypatch):
+    url, _ = ollama_stub(token_latency=0.01)
+    pool = LLMPool([Endpoint(url, 4)])
+    monkeypatch.setattr(main, "llm_pool", pool)
+    # Start without templates learned by earlier tests, so every question reaches the stub.
+    dataset = main.datasets.get(DEFAULT_DATASET)
+    monkeypatch.setattr(dataset, "template_cache", SQLTemplateCache(dataset.engine))
+    return pool
+
+
+@pytest.fixture
+def client(pool):
+    return TestClient(main.app)
+
+
+def test_results_in_question_order_with_per_question_errors(client):
+    resp = client.post("/chat/batch", json={"questions": QUESTIONS})
+    assert resp.status_code == 200
+    results = resp.json()["results"]
+    assert [r["index"] for r in results] == [0, 1, 2, 3]
+    assert [r["question"] for r in results] == QUESTIONS
+    assert results[1]["status_code"] == 400
+    assert "error" in results[1]
+    for r in (results[0], results[2], results[3]):
+        assert r["answer"] == "The transaction count is 0."
+        assert r["truncated"] is False
+
+
+def test_duplicate_questions_share_one_generation(client, pool):
+    resp = client.post("/chat/batch", json={"questions": [QUESTIONS[0].upper(), QUESTIONS[0], QUESTIONS[0] + "  "]})
+    assert [r["answer"] for r in resp.json()["results"]] == ["The transaction count is 0."] * 3
+    assert pool.endpoints[0].requests == 1
+
+
+def test_stream_emits_one_line_per_question(client):
+    resp = client.post("/chat/batch", json={"questions": QUESTIONS, "stream": True})
+    assert resp.headers["content-type"].startswith("application/x-ndjson")
+    entries = [json.loads(line) for line in resp.text.splitlines()]
+    assert sorted(e["index"] for e in entries) == [0, 1, 2, 3]
+    by_index = {e["index"]: e for e in entries}
+    assert by_index[1]["status_code"] == 400
+    assert by_index[3]["answer"] == "The transaction count is 0."
+
+
+def test_rejects_an_empty_batch(client):
+    assert client.post("/chat/batch", json={"questions": []}).status_code == 422
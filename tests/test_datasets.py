@@ -0,0 +1,90 @@
+import threading
+import time
+
+import pytest
+
+from app.datasets import DEFAULT_DATASET, Dataset, DatasetRegistry
+
+QIF = "!Type:Bank\nD03/01/2018\nT-10.00\nPAmazon\nLDues\n^\n"
+
+
+@pytest.fixture
+def registry(tmp_path):
+    for name in ("default", "root/a", "root/b"):
+        (tmp_path / name).mkdir(parents=True)
+        (tmp_path / name / "t.qif").write_text(QIF)
+    registry = DatasetRegistry(
+        str(tmp_path / "default"), str(tmp_path / "db" / "default.db"),
+        qif_root=str(tmp_path / "root"), db_root=str(tmp_path / "db"), max_open=1,
+    )
+    yield registry
+    for dataset in [*registry._pinned.values(), *registry._open.values()]:
+        dataset.close()
+
+
+def test_default_dataset_is_never_evicted(registry):
+    default = registry.get(DEFAULT_DATASET)
+    registry.get("a")
+    registry.get("b")
+    assert registry.stats() == {"pinned": [DEFAULT_DATASET], "open": ["b"], "max_open": 1}
+    assert registry.get(DEFAULT_DATASET) is default
+
+
+def test_failed_ingest_does_not_leak_its_lock(registry, monkeypatch):
+    def fail(self):
+        raise RuntimeError("ingest failed")
+
+    monkeypatch.setattr(Dataset, "open", fail)
+    with pytest.raises(RuntimeError):
+        registry.get("a")
+    assert registry._opening == {}
+
+
+def test_unknown_and_malformed_identifiers(registry):
+    with pytest.raises(LookupError):
+        registry.get("missing")
+    with pytest.raises(ValueError):
+        registry.get("../etc")
+
+
+def test_retries_after_a_failed_ingest_never_run_side_by_side(registry, monkeypatch):
+    real_open = Dataset.open
+    state = {"calls": 0, "active": 0, "max_active": 0}
+    guard = threading.Lock()
+
+    def flaky_open(self):
+        with guard:
+            state["calls"] += 1
+            state["active"] += 1
+            state["max_active"] = max(state["max_active"], state["active"])
+            first = state["calls"] == 1
+        try:
+            time.sleep(0.05)
+            if first:
+                raise RuntimeError("ingest failed")
+            real_open(self)
+        finally:
+            with guard:
+                state["active"] -= 1
+
+    monkeypatch.setattr(Dataset, "open", flaky_open)
+    results = []
+
+    def request():
+        try:
+            results.append(registry.get("a"))
+        except RuntimeError:
+            results.append(None)
+
+    threads = []
+    for _ in range(6):
+        threads.append(threading.Thread(target=request))
+        threads[-1].start()
+        time.sleep(0.02)
+    for thread in threads:
+        thread.join()
+
+    assert state["max_active"] == 1
+    opened = {id(r) for r in results if r is not None}
+    assert len(opened) == 1
+    assert registry._opening == {}
@@ -0,0 +1,87 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+from app import main
+from app.llm_pool import Endpoint, LLMPool
+
+
+def use_pool(monkeypatch, urls, **kwargs):
+    pool = LLMPool([Endpoint(url, 2) for url in urls], **kwargs)
+    monkeypatch.setattr(main, "llm_pool", pool)
+    return pool
+
+
+def test_least_outstanding_routing(ollama_stub):
+    (a, _), (b, _) = ollama_stub(), ollama_stub()
+    pool = LLMPool([Endpoint(a, 2), Endpoint(b, 2)])
+    held = [pool.acquire() for _ in range(3)]
+    assert [ep.url for ep in held] == [a, b, a]
+    pool.release(held[0], ok=True)
+    # a and b now both have one request outstanding; the next two spread over them.
+    assert {pool.acquire().url, pool.acquire().url} == {a, b}
+
+
+def test_requests_spread_over_endpoints(ollama_stub, monkeypatch):
+    (a, _), (b, _) = ollama_stub(token_latency=0.005), ollama_stub(token_latency=0.005)
+    pool = use_pool(monkeypatch, [a, b])
+    with ThreadPoolExecutor(4) as executor:
+        answers = list(executor.map(main.generate_sql, ["How many transactions in 2018?"] * 8))
+    assert all(sql.startswith("SELECT COUNT(*)") for sql in answers)
+    # Four workers fill both endpoints' two slots, so neither one can take everything.
+    assert sum(ep.requests for ep in pool.endpoints) == 8
+    assert min(ep.requests for ep in pool.endpoints) >= 2
+    assert pool.stats()["in_flight"] == 0
+
+
+def test_full_queue_returns_429_with_retry_after(ollama_stub, monkeypatch):
+    url, _ = ollama_stub()
+    pool = use_pool(monkeypatch, [url], max_queue=0)
+    held = [pool.acquire(), pool.acquire()]
+    try:
+        resp = TestClient(main.app).post("/chat", json={"question": "How many transactions in 2018?"})
+    finally:
+        for endpoint in held:
+            pool.release(endpoint, ok=True)
+    assert resp.status_code == 429
+    assert int(resp.headers["Retry-After"]) >= 1
+
+
+def test_breaker_opens_then_recovers_after_a_half_open_probe(ollama_stub, monkeypatch):
+    url, config = ollama_stub(error_rate=1.0)
+    pool = use_pool(monkeypatch, [url], failure_threshold=2, cooldown=0.2)
+    for _ in range(2):
+        with pytest.raises(HTTPException) as failed:
+            main.generate_sql("How many transactions in 2018?")
+        assert failed.value.status_code == 503
+    assert pool.stats()["endpoints"][0]["state"] == "open"
+
+    # While open the endpoint is not even tried.
+    with pytest.raises(HTTPException) as rejected:
+        main.generate_sql("How many transactions in 2018?")
+    assert rejected.value.headers["Retry-After"] == "1"
+    assert pool.endpoints[0].requests == 2
+
+    time.sleep(0.25)
+    assert pool.stats()["endpoints"][0]["state"] == "half_open"
+    probe = pool.acquire()
+    assert not pool.endpoints[0].available(time.monotonic())  # one probe at a time
+    pool.release(probe, ok=False)
+    assert pool.stats()["endpoints"][0]["state"] == "open"  # a failed probe re-opens it
+
+    time.sleep(0.25)
+    config.error_rate = 0.0
+    assert main.generate_sql("How many transactions in 2018?").startswith("SELECT COUNT(*)")
+    assert pool.stats()["endpoints"][0]["state"] == "closed"
+
+
+def test_failover_to_a_healthy_endpoint(ollama_stub, monkeypatch):
+    (bad, _), (good, _) = ollama_stub(error_rate=1.0), ollama_stub()
+    pool = use_pool(monkeypatch, [bad, good])
+    assert main.generate_sql("How many transactions in 2018?").startswith("SELECT COUNT(*)")
+    stats = {ep["url"]: ep for ep in pool.stats()["endpoints"]}
+    assert (stats[bad]["requests"], stats[bad]["errors"]) == (1, 1)
+    assert (stats[good]["requests"], stats[good]["errors"]) == (1, 0)
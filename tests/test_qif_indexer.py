@@ -0,0 +1,98 @@
+import fcntl
+import json
+import os
+
+import pytest
+
+from app.qif_indexer import QIFIndexer
+
+QIF = "!Type:Bank\nD03/01/2018\nT-10.00\nPAmazon\nLDues\n^\n"
+
+
+@pytest.fixture
+def paths(tmp_path):
+    qif_dir = tmp_path / "qifs"
+    qif_dir.mkdir()
+    (qif_dir / "a.qif").write_text(QIF)
+    return str(qif_dir), str(tmp_path / "db" / "transactions.db")
+
+
+def open_indexer(paths):
+    indexer = QIFIndexer(*paths)
+    indexer.ensure_database()
+    return indexer
+
+
+# flock() locks belong to the open file, so indexers in one process contend like workers do.
+def test_one_leader_and_read_only_followers(paths):
+    leader, follower = open_indexer(paths), open_indexer(paths)
+    try:
+        assert (leader.role, follower.role) == ("leader", "follower")
+        assert follower.generation == leader.generation == 1
+        assert "mode=ro" in str(follower.engine.url)
+    finally:
+        follower.close()
+        leader.close()
+
+
+def test_new_leader_takes_over_without_rebuilding_under_followers(paths):
+    leader, follower = open_indexer(paths), open_indexer(paths)
+    leader.close()
+    successor = open_indexer(paths)
+    bystander = open_indexer(paths)
+    try:
+        assert successor.role == "leader"
+        assert successor.generation == 1
+        # The successor holds the leader lock, so a later worker cannot become a second writer.
+        assert bystander.role == "follower"
+    finally:
+        for indexer in (bystander, successor, follower):
+            indexer.close()
+
+
+def test_restart_reuses_a_ready_database(paths):
+    open_indexer(paths).close()
+    indexer = open_indexer(paths)
+    try:
+        assert (indexer.role, indexer.generation) == ("leader", 1)
+    finally:
+        indexer.close()
+
+
+def test_follower_ignores_a_stale_ready_marker_for_a_deleted_database(paths):
+    open_indexer(paths).close()
+    os.remove(paths[1])  # force a re-ingest; the marker still says "ready"
+
+    # Another worker holds the leader lock but has not started building yet.
+    with open(f"{paths[1]}.leader", "a+") as leader_lock:
+        fcntl.flock(leader_lock, fcntl.LOCK_EX)
+        follower = QIFIndexer(*paths)
+        follower.ready_timeout = 0.2
+        with pytest.raises(RuntimeError):
+            follower.ensure_database()
+        follower.close()
+
+    leader, follower = open_indexer(paths), open_indexer(paths)
+    try:
+        assert (leader.role, leader.generation) == ("leader", 2)
+        assert (follower.role, follower.generation) == ("follower", 2)
+    finally:
+        follower.close()
+        leader.close()
+
+
+def test_leader_retracts_a_stale_ready_marker(paths):
+    open_indexer(paths).close()
+    os.remove(paths[1])
+
+    # A reader still holding the ingest lock keeps the new leader from rebuilding.
+    with open(f"{paths[1]}.lock", "a+") as ingest_lock:
+        fcntl.flock(ingest_lock, fcntl.LOCK_SH)
+        leader = QIFIndexer(*paths)
+        leader.ready_timeout = 0.2
+        with pytest.raises(RuntimeError):
+            leader.ensure_database()
+        leader.close()
+
+    with open(f"{paths[1]}.generation") as f:
+        assert json.load(f)["state"] == "building"
@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+from app.singleflight import SingleFlight
+
+
+def test_concurrent_callers_share_one_call():
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "rows"
+
+    async def main():
+        flight = SingleFlight("test")
+        results = await asyncio.gather(*(flight.do("key", work) for _ in range(5)))
+        return results, flight.in_flight()
+
+    results, in_flight = asyncio.run(main())
+    assert results == ["rows"] * 5
+    assert len(calls) == 1
+    assert in_flight == 0
+
+
+def test_error_reaches_every_waiter():
+    async def work():
+        await asyncio.sleep(0.01)
+        raise ValueError("bad SQL")
+
+    async def main():
+        flight = SingleFlight("test")
+        results = await asyncio.gather(*(flight.do("key", work) for _ in range(3)), return_exceptions=True)
+        return results, flight.in_flight()
+
+    results, in_flight = asyncio.run(main())
+    assert [type(r) for r in results] == [ValueError] * 3
+    assert in_flight == 0
+
+
+def test_cancelling_one_waiter_keeps_the_shared_work():
+    async def main():
+        flight = SingleFlight("test")
+        release = asyncio.Event()
+
+        async def work():
+            await release.wait()
+            return "rows"
+
+        first = asyncio.ensure_future(flight.do("key", work))
+        second = asyncio.ensure_future(flight.do("key", work))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(main()) == "rows"
+
+
+def test_cancelling_the_last_waiter_cancels_the_work():
+    async def main():
+        flight = SingleFlight("test")
+        started, cancelled = asyncio.Event(), asyncio.Event()
+
+        async def work():
+            started.set()
+            try:
+                await asyncio.sleep(60)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        waiter = asyncio.ensure_future(flight.do("key", work))
+        await started.wait()
+        waiter.cancel()
+        await asyncio.wait_for(cancelled.wait(), 1)
+        # A new caller starts fresh instead of joining the dying task.
+        assert flight.in_flight() == 0
+        return await flight.do("key", lambda: asyncio.sleep(0, result="fresh"))
+
+    assert asyncio.run(main()) == "fresh"
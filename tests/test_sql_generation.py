@@ -0,0 +1,61 @@
+import logging
+
+import pytest
+
+from app import main
+from app.llm_pool import Endpoint, LLMPool
+
+PROMPT = "Question: Total Dues in 2018\nSQL:"
+
+
+@pytest.fixture
+def stub_pool(ollama_stub, monkeypatch):
+    def start(response: str):
+        url, _ = ollama_stub(response=response)
+        monkeypatch.setattr(main, "llm_pool", LLMPool([Endpoint(url, 2)]))
+        return url
+
+    return start
+
+
+@pytest.mark.parametrize(
+    "raw, expected",
+    [
+        ("SELECT 1;", "SELECT 1"),
+        ("```sql\nSELECT 1\n```", "SELECT 1\n"),
+        ("SELECT a\nFROM t\n\nThis query", "SELECT a\nFROM t"),
+        ("SELECT a\nFROM t\n\nWHERE b = 1", None),
+        ("SELECT a\nFROM t\n\nThis", None),  # the word may still grow into something else
+        ("SELECT a\nFROM t\n\n", None),
+    ],
+)
+def test_complete_statement(raw, expected):
+    assert main._complete_statement(raw) == expected
+
+
+def test_blank_line_inside_the_statement_does_not_end_it(stub_pool, caplog):
+    stub_pool("SELECT SUM(amount)\nFROM transactions\n\nWHERE category = 'Dues'\n\nThis sums the dues for you.")
+    with caplog.at_level(logging.INFO, logger="app.main"):
+        sql = main.generate_sql("Total Dues")
+    assert sql == "SELECT SUM(amount) FROM transactions WHERE category = 'Dues'"
+    assert "stopped_early=True" in caplog.text
+
+
+def test_prose_after_a_blank_line_stops_generation(stub_pool):
+    url = stub_pool("SELECT COUNT(*) FROM transactions\n\nThis counts every transaction " + "and more " * 50)
+    raw = main._stream_sql(url, PROMPT)
+    assert raw == "SELECT COUNT(*) FROM transactions"
+
+
+def test_failed_prefix_is_parsed_once(stub_pool, monkeypatch):
+    url = stub_pool("SELECT SUM(amount) FROM\n\nThis is not finished " + "at all " * 20)
+    calls = []
+    sanitize = main.sanitize_llm_sql
+
+    def counting(sql):
+        calls.append(sql)
+        return sanitize(sql)
+
+    monkeypatch.setattr(main, "sanitize_llm_sql", counting)
+    main._stream_sql(url, PROMPT)
+    assert calls == ["SELECT SUM(amount) FROM"]
@@ -0,0 +1,101 @@
+import pytest
+from sqlalchemy import create_engine, text
+
+from app import sql_rewriter
+from app.sql_rewriter import cap_rows, parse_select, rewrite_sql
+
+
+@pytest.mark.parametrize(
+    "sql",
+    [
+        "SELECT 1; DELETE FROM transactions",
+        "ATTACH DATABASE '/tmp/other.db' AS other",
+        "PRAGMA table_info(transactions)",
+        "WITH t AS (SELECT 1) DELETE FROM transactions",
+        "SELECT load_extension('/tmp/evil.so')",
+        "Here is the query: SELECT * FROM transactions",
+        "SELECT * FROM transactions\n\nThis query lists everything.",
+        "",
+    ],
+)
+def test_rejects_anything_but_one_select(sql):
+    with pytest.raises(ValueError):
+        parse_select(sql)
+
+
+def test_year_filter_becomes_a_date_range():
+    sql, params = rewrite_sql("SELECT SUM(amount) FROM transactions WHERE strftime('%Y', date) = '2018'")
+    assert sql == "SELECT SUM(amount) FROM transactions WHERE (date >= :p0 AND date < :p1)"
+    assert params == {"p0": "2018-01-01", "p1": "2019-01-01"}
+
+
+def test_month_filter_becomes_a_date_range():
+    sql, params = rewrite_sql("SELECT SUM(amount) FROM transactions WHERE strftime('%Y-%m', date) = '2019-12'")
+    assert "strftime" not in sql
+    assert params == {"p0": "2019-12-01", "p1": "2020-01-01"}
+
+
+def test_lower_is_dropped_from_like():
+    sql, params = rewrite_sql("SELECT COUNT(*) FROM transactions WHERE LOWER(payee) LIKE '%amazon%'")
+    assert sql == "SELECT COUNT(*) FROM transactions WHERE payee LIKE :p0"
+    assert params == {"p0": "%amazon%"}
+
+
+def test_lower_equality_becomes_collate_nocase():
+    sql, params = rewrite_sql("SELECT COUNT(*) FROM transactions WHERE LOWER(category) = 'dues'")
+    assert sql == "SELECT COUNT(*) FROM transactions WHERE category = :p0 COLLATE NOCASE"
+    assert params == {"p0": "dues"}
+
+
+def test_lower_equality_with_mixed_case_is_left_alone():
+    sql, _ = rewrite_sql("SELECT COUNT(*) FROM transactions WHERE LOWER(category) = 'Dues'")
+    assert "LOWER(category)" in sql
+
+
+def test_star_is_expanded_and_unused_subquery_columns_pruned():
+    sql, _ = rewrite_sql("SELECT * FROM transactions")
+    assert sql == "SELECT date, payee, category, memo, amount FROM transactions"
+    sql, _ = rewrite_sql("SELECT s.total FROM (SELECT payee, memo, SUM(amount) AS total FROM transactions) AS s")
+    assert sql == "SELECT s.total FROM (SELECT SUM(amount) AS total FROM transactions) AS s"
+
+
+def test_negative_amount_is_one_bind():
+    sql, params = rewrite_sql("SELECT COUNT(*) FROM transactions WHERE amount < -50")
+    assert sql == "SELECT COUNT(*) FROM transactions WHERE amount < :p0"
+    assert params == {"p0": -50}
+
+
+def test_ordinals_in_nested_selects_stay_inline():
+    query = (
+        "SELECT t.payee, s.n FROM transactions t "
+        "JOIN (SELECT payee, COUNT(*) AS n FROM transactions GROUP BY 1 ORDER BY 1) s ON s.payee = t.payee "
+        "ORDER BY 1"
+    )
+    sql, params = rewrite_sql(query)
+    assert params == {}
+
+    engine = create_engine("sqlite://")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE transactions (date DATE, payee TEXT, category TEXT, memo TEXT, amount REAL)"))
+        conn.execute(text("INSERT INTO transactions (payee) VALUES ('A'), ('A'), ('B')"))
+        assert conn.execute(text(sql), params).all() == conn.execute(text(query)).all() == [
+            ("A", 2), ("A", 2), ("B", 1)
+        ]
+
+
+def test_row_limit_fetches_one_extra_row(monkeypatch):
+    monkeypatch.setattr(sql_rewriter, "row_limit", 2)
+    sql, params = rewrite_sql("SELECT payee FROM transactions")
+    assert sql == "SELECT payee FROM transactions LIMIT :row_limit"
+    assert params == {"row_limit": 3}
+    assert cap_rows([1, 2, 3], params) == ([1, 2], True)
+    assert cap_rows([1, 2], params) == ([1, 2], False)
+
+    # Aggregates and queries with their own LIMIT are left alone.
+    assert rewrite_sql("SELECT COUNT(*) FROM transactions")[1] == {}
+    assert rewrite_sql("SELECT payee FROM transactions LIMIT 5")[1] == {}
+
+
+def test_row_limit_is_off_by_default():
+    assert sql_rewriter.row_limit == 0
+    assert cap_rows([1, 2, 3], rewrite_sql("SELECT payee FROM transactions")[1]) == ([1, 2, 3], False)
@@ -0,0 +1,68 @@
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import StaticPool
+
+from app.sql_rewriter import rewrite_sql
+from app.sql_templates import SQLTemplateCache
+
+
+@pytest.fixture
+def cache():
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE transactions (date DATE, payee TEXT, category TEXT, memo TEXT, amount REAL)"))
+        conn.execute(
+            text("INSERT INTO transactions VALUES ('2018-03-01', 'Amazon', 'Dues', '', -10), "
+                 "('2019-03-02', 'Power Co', 'Utilities', '', -20)")
+        )
+    return SQLTemplateCache(engine)
+
+
+def learn(cache, question, sql):
+    match = cache.match(question)
+    cache.learn(match, *rewrite_sql(sql))
+    return match
+
+
+def test_year_range_is_rebound(cache):
+    learn(cache, "Total Dues in 2018", "SELECT SUM(amount) FROM transactions WHERE category = 'Dues' "
+                                       "AND date >= '2018-01-01' AND date < '2019-01-01'")
+    sql, params = cache.lookup(cache.match("total Utilities in 2021"))
+    assert sorted(params.values()) == ["2021-01-01", "2022-01-01", "Utilities"]
+
+
+def test_inclusive_year_end_is_rebound(cache):
+    learn(cache, "Total Dues in 2018", "SELECT SUM(amount) FROM transactions WHERE category = 'Dues' "
+                                       "AND date BETWEEN '2018-01-01' AND '2018-12-31'")
+    sql, params = cache.lookup(cache.match("total Utilities in 2021"))
+    assert "2018" not in str(params)
+    assert "2021-12-31" in params.values()
+
+
+def test_inclusive_month_end_is_rebound(cache):
+    learn(cache, "Total Dues in March 2019", "SELECT SUM(amount) FROM transactions WHERE category = 'Dues' "
+                                             "AND date >= '2019-03-01' AND date <= '2019-03-31'")
+    sql, params = cache.lookup(cache.match("total Dues in February 2020"))
+    assert sorted(params.values()) == ["2020-02-01", "2020-02-29", "Dues"]
+
+
+def test_constant_containing_a_slot_is_not_cached(cache):
+    # '2018-06-30' derives from nothing in the question but still embeds its year.
+    match = learn(cache, "Total Dues in 2018", "SELECT SUM(amount) FROM transactions WHERE category = 'Dues' "
+                                               "AND date >= '2018-01-01' AND date <= '2018-06-30'")
+    assert cache.lookup(match) is None
+
+
+def test_unrelated_constant_is_kept(cache):
+    learn(cache, "Total Dues in 2018", "SELECT SUM(amount) FROM transactions WHERE category = 'Dues' "
+                                       "AND date >= '2018-01-01' AND date < '2019-01-01' AND amount < 0")
+    sql, params = cache.lookup(cache.match("total Utilities in 2020"))
+    assert sorted(map(str, params.values())) == ["0", "2020-01-01", "2021-01-01", "Utilities"]
+
+
+def test_year_range_is_only_reused_in_the_learned_order(cache):
+    learn(cache, "Total spent between 2018 and 2019", "SELECT SUM(amount) FROM transactions "
+                                                      "WHERE date BETWEEN '2018-01-01' AND '2019-12-31'")
+    sql, params = cache.lookup(cache.match("Total spent between 2020 and 2022"))
+    assert sorted(params.values()) == ["2020-01-01", "2022-12-31"]
+    assert cache.lookup(cache.match("Total spent between 2019 and 2018")) is None
@@ -1,11 +1,81 @@
+import json
 import os
 from datetime import datetime
 
+import pandas as pd
 import requests
 import streamlit as st
 import streamlit.components.v1 as components
+from requests.adapters import HTTPAdapter
 
 QIF_API_URL = os.environ.get("QIF_API_URL", "http://qif-agent:8000")
+# Dataset served by a multi-tenant backend; empty means the backend default.
+QIF_DATASET = os.environ.get("QIF_DATASET", "")
+# Only the most recent entries are rendered; older ones load on demand.
+HISTORY_WINDOW = int(os.environ.get("HISTORY_WINDOW", "10"))
+# Result tables are shown this many rows per page.
+TABLE_PAGE_SIZE = int(os.environ.get("TABLE_PAGE_SIZE", "200"))
+
+
+@st.cache_resource
+def get_api_session():
+    """One keep-alive HTTP session shared by every rerun and browser session."""
+    session = requests.Session()
+    session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+    session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+    return session
+
+
+def ask_agent(question, status):
+    """
+    Send ``question`` to the streaming chat endpoint and build the assistant
+    history entry as events arrive, updating ``status`` along the way.
+    """
+    columns = None
+    rows = []
+    answer = "No answer."
+    with get_api_session().post(
+        f"{QIF_API_URL}/chat/stream",
+        json={"question": question},
+        headers={"X-Dataset": QIF_DATASET} if QIF_DATASET else None,
+        stream=True,
+        timeout=(5, 120),
+    ) as resp:
+        resp.raise_for_status()
+        for line in resp.iter_lines():
+            if not line:
+                continue
+            event = json.loads(line)
+            kind = event.get("event")
+            if kind == "status":
+                status.update(label=event["message"])
+            elif kind == "columns":
+                columns = event["columns"]
+            elif kind == "rows":
+                rows.extend(event["rows"])
+                status.update(label=f"Received {len(rows)} rows...")
+            elif kind == "answer":
+                answer = event["answer"]
+            elif kind == "error":
+                answer = f"❌ Error: {event['detail']}"
+
+    entry = {"role": "assistant", "content": answer}
+    if columns:
+        entry["table"] = pd.DataFrame(rows, columns=columns)
+    return entry
+
+
+def render_table(table, key):
+    total = len(table)
+    if total > TABLE_PAGE_SIZE:
+        pages = (total + TABLE_PAGE_SIZE - 1) // TABLE_PAGE_SIZE
+        page = st.number_input(
+            f"Page (of {pages})", min_value=1, max_value=pages, value=1, step=1, key=f"table-page-{key}"
+        )
+        start = (page - 1) * TABLE_PAGE_SIZE
+        table = table.iloc[start : start + TABLE_PAGE_SIZE]
+    st.dataframe(table, use_container_width=True, hide_index=True)
+
 
 st.set_page_config(page_title="Chat with QIF AI Agent", page_icon="💸", layout="wide")
 
@@ -19,6 +89,8 @@ if "results_container_height" not in st.session_state:
     st.session_state.results_container_height = 420
 if "results_scroll_target" not in st.session_state:
     st.session_state.results_scroll_target = None
+if "history_visible" not in st.session_state:
+    st.session_state.history_visible = HISTORY_WINDOW
 
 st.markdown(
     """
@@ -85,18 +157,13 @@ if user_input:
     st.rerun()
 
 if st.session_state.pending_question:
-    with st.spinner("Processing your request..."):
+    with st.status("Processing your request...") as status:
         try:
-            resp = requests.post(
-                f"{QIF_API_URL}/chat",
-                json={"question": st.session_state.pending_question},
-                timeout=60,
-            )
-            answer = resp.json().get("answer", "No answer.")
+            entry = ask_agent(st.session_state.pending_question, status)
         except Exception as e:
-            answer = f"❌ Error: {e}"
+            entry = {"role": "assistant", "content": f"❌ Error: {e}"}
 
-    st.session_state.history.append({"role": "assistant", "content": answer})
+    st.session_state.history.append(entry)
     st.session_state.pending_question = None
     st.session_state.is_processing = False
     st.rerun()
@@ -112,6 +179,7 @@ with left_col:
 with clear_col:
     if st.button("🧹", help="Clear results", use_container_width=True, type="secondary"):
         st.session_state.history = []
+        st.session_state.history_visible = HISTORY_WINDOW
         st.session_state.pending_question = None
         st.session_state.is_processing = False
         st.rerun()
@@ -135,9 +203,19 @@ with results_container:
     if not st.session_state.history:
         st.caption("No results yet. Ask a question to see responses here.")
 
-    for entry in st.session_state.history:
+    history = st.session_state.history
+    first_visible = max(len(history) - st.session_state.history_visible, 0)
+    if first_visible:
+        if st.button(f"Show {min(first_visible, HISTORY_WINDOW)} older of {first_visible} hidden entries"):
+            st.session_state.history_visible += HISTORY_WINDOW
+            st.rerun()
+
+    for index in range(first_visible, len(history)):
+        entry = history[index]
         with st.chat_message(entry["role"]):
             st.markdown(entry["content"])
+            if entry.get("table") is not None:
+                render_table(entry["table"], index)
 
     st.markdown('<div id="results-bottom-marker"></div>', unsafe_allow_html=True)
 